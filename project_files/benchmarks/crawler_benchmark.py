@@ -0,0 +1,71 @@
+# Benchmark for utils.crawler.Crawler against a local HTTP stub of the FAA waivers_issued pages.
+# Every response is delayed to simulate network latency. Run from project_files: python -m benchmarks.crawler_benchmark
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from utils.crawler import Crawler, create_session
+
+PAGES = 10
+PDFS_PER_PAGE = 20
+LATENCY = 0.05              # seconds per response
+PDF_SIZE = 256 * 1024
+CONCURRENCY_LEVELS = (1, 4, 16)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCY)
+        path = urlparse(self.path)
+        if path.path == '/waivers_issued':
+            page = int(parse_qs(path.query).get('page', ['0'])[0])
+            # Like the FAA site, pages past the end repeat the last page
+            page = min(page, PAGES - 1)
+            links = "".join(f'<a href="/files/waiver-{page}-{i}.pdf">Waiver</a>' for i in range(PDFS_PER_PAGE))
+            self.respond(f"<html><body>{links}</body></html>".encode(), 'text/html')
+        elif path.path.endswith('.pdf'):
+            self.respond(b'%PDF-1.4\n' + b'0' * PDF_SIZE, 'application/pdf')
+        else:
+            self.send_error(404)
+
+    def respond(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def run(base_url, concurrency):
+    downloaded = []
+
+    async def download(crawler, url):
+        response = await crawler.fetch(url)
+        downloaded.append(len(response.content))
+
+    crawler = Crawler(create_session(pool_size=concurrency), per_host_limit=concurrency)
+    failed = await crawler.crawl(base_url, download, download_workers=concurrency)
+    return len(downloaded), failed
+
+
+if __name__ == '__main__':
+    server = start_stub_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/waivers_issued"
+    print(f"{'concurrency':>12} {'pdfs':>6} {'seconds':>8} {'pdfs/second':>12}")
+    for concurrency in CONCURRENCY_LEVELS:
+        start = time.perf_counter()
+        count, failed = asyncio.run(run(base_url, concurrency))
+        seconds = time.perf_counter() - start
+        assert count == PAGES * PDFS_PER_PAGE and not failed
+        print(f"{concurrency:>12} {count:>6} {seconds:>8.2f} {count / seconds:>12.1f}")
+    server.shutdown()
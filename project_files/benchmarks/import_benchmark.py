@@ -0,0 +1,54 @@
+# Benchmark of the import time of the Lambda entry points and of each stage module, i.e. the part of a cold
+# start paid before a handler runs. Every import is timed in a fresh interpreter, with dummy AWS settings, and the
+# heavy libraries it loaded are listed. The reference rows import boto3 alone, which every stage needs and which
+# dominates their import time, and all the libraries up front, like the scripts used to. A stage costs about as
+# much as the eager imports: the lazy imports keep the other stages out of a handler, not boto3.
+# Run from project_files: python -m benchmarks.import_benchmark
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUNS = 5
+HEAVY_LIBRARIES = ('boto3', 'requests', 'bs4', 'openpyxl', 'PyPDF2', 'dateutil')
+MODULES = (
+    ('handlers', 'import handlers'),
+    ('handlers + download stage', 'import handlers, pdfdownloadcloud'),
+    ('handlers + textract stage', 'import handlers, textractactioncloud'),
+    ('handlers + excel stage', 'import handlers, jsontoexcelcloud'),
+    ('boto3 only', 'import boto3'),
+    ('eager (all libraries)', 'import boto3, requests, bs4, openpyxl, PyPDF2, dateutil.parser'),
+)
+
+# Run in the child interpreter: time the import and report the heavy libraries it loaded
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+exec({statement!r})
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'loaded': [name for name in {libraries!r} if name in sys.modules]}}))
+"""
+
+def time_import(statement, env):
+    output = subprocess.run([sys.executable, '-c', CHILD.format(statement=statement, libraries=HEAVY_LIBRARIES)],
+                            env=env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+def main():
+    directory = tempfile.mkdtemp()
+    env = dict(os.environ, AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark',
+               AWS_REGION='us-east-1', TEXTRACT_JOB_STORE=os.path.join(directory, 'jobs.db'))
+    print(f"{'entry point':<28}{'median ms':>10}{'min ms':>9}  heavy libraries loaded")
+    for name, statement in MODULES:
+        # The first run warms the file system cache and the bytecode caches
+        time_import(statement, env)
+        results = [time_import(statement, env) for _ in range(RUNS)]
+        seconds = [result['seconds'] for result in results]
+        print(f"{name:<28}{statistics.median(seconds) * 1000:>10.0f}{min(seconds) * 1000:>9.0f}  "
+              f"{', '.join(results[-1]['loaded']) or '-'}")
+
+if __name__ == '__main__':
+    main()
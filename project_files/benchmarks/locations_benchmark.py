@@ -0,0 +1,71 @@
+# Benchmark for utils.locations.LocationsIndex against the per-waiver full scans of the Locations sheet
+# it replaced. Run from project_files: python -m benchmarks.locations_benchmark
+import random
+import time
+from openpyxl import Workbook
+from utils.locations import LocationsIndex
+
+SHEET_SIZES = (10000, 100000)
+WAIVERS = 200
+LEGACY_WAIVERS = 10  # the full scans are slow, so the legacy timing uses fewer waivers
+
+
+def build_sheet(rows):
+    sheet = Workbook().active
+    sheet.append(["Operator ID", "Company ID", "Full Operator ID", "Responsible Person", "Street Name and Number",
+                  "City", "State", "Zip Code", "", "", "", "Company"])
+    for operator_id in range(1, rows + 1):
+        sheet.append([operator_id, f"C{operator_id}", f"{operator_id}-C{operator_id}", f"Person {operator_id}",
+                      f"{operator_id} Main St", "City", "State", "00000", "", "", "", f"Company {operator_id}"])
+    return sheet
+
+
+def new_location(operator_id, company_id, responsible_person):
+    return [operator_id, company_id, f"{operator_id}-{company_id}", responsible_person,
+            "1 New St", "City", "State", "00000", "", "", "", "Company"]
+
+
+# The lookups jsontoexcelcloud used to run for every waiver
+def legacy_waiver(sheet, responsible_person):
+    matching_rows = [row for row in sheet.iter_rows(min_row=2, values_only=True)
+                     if row and len(row) > 3 and row[3] and row[3].strip() == responsible_person]
+    operator_ids = [row[0] for row in sheet.iter_rows(min_row=2, values_only=True) if row and row[0] is not None]
+    company_ids = [int(row[1][1:]) for row in sheet.iter_rows(min_row=2, values_only=True)
+                   if row and row[1] and row[1].startswith('C')]
+    operator_id = matching_rows[0][0] if matching_rows else (max(operator_ids) + 1 if operator_ids else 1)
+    company_id = f"C{(max(company_ids) + 1) if company_ids else 1}"
+    first_empty_row = sheet.max_row + 1
+    for row in range(2, sheet.max_row + 2):
+        if not sheet.cell(row=row, column=1).value:
+            first_empty_row = row
+            break
+    for col, value in enumerate(new_location(operator_id, company_id, responsible_person), start=1):
+        sheet.cell(row=first_empty_row, column=col, value=value)
+
+
+def indexed_waiver(index, responsible_person):
+    matching_rows = index.find_rows(responsible_person)
+    operator_id = matching_rows[0][0] if matching_rows else index.next_operator_id()
+    index.append(new_location(operator_id, index.next_company_id(), responsible_person))
+
+
+def timed(func, people):
+    start = time.perf_counter()
+    for responsible_person in people:
+        func(responsible_person)
+    return (time.perf_counter() - start) / len(people)
+
+
+if __name__ == '__main__':
+    print(f"{'rows':>8} {'legacy ms/waiver':>17} {'index build ms':>15} {'index ms/waiver':>16} {'speedup':>9}")
+    for rows in SHEET_SIZES:
+        people = [f"Person {random.randint(1, rows * 2)}" for _ in range(WAIVERS)]
+        legacy_sheet = build_sheet(rows)
+        legacy = timed(lambda person: legacy_waiver(legacy_sheet, person), people[:LEGACY_WAIVERS])
+        sheet = build_sheet(rows)
+        start = time.perf_counter()
+        index = LocationsIndex(sheet)
+        build = time.perf_counter() - start
+        indexed = timed(lambda person: indexed_waiver(index, person), people)
+        per_waiver = indexed + build / WAIVERS
+        print(f"{rows:>8} {legacy * 1000:>17.2f} {build * 1000:>15.1f} {indexed * 1000:>16.4f} {legacy / per_waiver:>8.0f}x")
@@ -0,0 +1,150 @@
+# Check of utils.scheduler.run_textract_jobs_notified against SNS and SQS stand-ins from moto, with the simulated
+# Textract client of scheduler_benchmark. Job completions are published to an SNS topic with an SQS queue
+# subscribed to it, like Textract's NotificationChannel. Some notifications are lost, malformed messages and
+# notifications for unknown jobs are mixed in, and some jobs were started by an earlier run and are resumed.
+# Every document must be saved exactly once, and the queue left empty. Needs moto.
+# Run from project_files: python -m benchmarks.notification_benchmark
+import json
+import logging
+import os
+import random
+import boto3
+from moto import mock_aws
+from benchmarks.scheduler_benchmark import FakeTextractClient, SimulatedClock
+from utils.scheduler import run_textract_jobs_notified
+
+DOCUMENTS = 200
+MAX_IN_FLIGHT = 10
+RESUMED = 15                # jobs started by an earlier run, whose notifications were consumed by it
+LOST_NOTIFICATIONS = 0.1    # share of completions never published
+MALFORMED_MESSAGES = 0.05   # chance of a malformed message per receive
+UNKNOWN_JOBS = 0.05         # chance of a notification for a job of another stage per receive
+SWEEP_INTERVAL = 300
+
+
+# Publishes a completion notification to SNS when a job finishes, unless it is lost
+class NotifyingTextractClient(FakeTextractClient):
+    def __init__(self, clock, sns_client, topic_arn, seed=0):
+        super().__init__(clock, seed)
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.loss = random.Random(seed + 1)
+        self.unpublished = {}       # JobId -> document, for jobs not finished yet
+        self.starts = 0
+        self.lost = 0
+        self.get_total = 0
+
+    def start_document_text_detection(self, DocumentLocation):
+        self.starts += 1
+        job_id = super().start_document_text_detection(DocumentLocation)['JobId']
+        self.unpublished[job_id] = DocumentLocation['S3Object']['Name']
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId):
+        self.get_total += 1
+        return super().get_document_text_detection(JobId)
+
+    # Publish the notifications of the jobs finished by now
+    def publish_finished(self):
+        for job_id, document in list(self.unpublished.items()):
+            if self.clock.now < self.jobs[job_id]:
+                continue
+            del self.unpublished[job_id]
+            if self.loss.random() < LOST_NOTIFICATIONS:
+                self.lost += 1
+                continue
+            self.sns_client.publish(TopicArn=self.topic_arn, Message=json.dumps({
+                'JobId': job_id, 'Status': 'SUCCEEDED', 'API': 'StartDocumentTextDetection',
+                'DocumentLocation': {'S3ObjectName': document, 'S3Bucket': 'bench'}}))
+
+    # Time until the next job finishes
+    def next_finish(self):
+        return min((self.jobs[job_id] - self.clock.now for job_id in self.unpublished), default=None)
+
+
+# SQS client whose long polls take simulated time: a receive waits until the next job finishes, or
+# wait_time seconds, and only then reads the moto queue. Also mixes in malformed and unknown messages.
+class SimulatedQueueClient:
+    def __init__(self, sqs_client, textract_client, clock, seed=0):
+        self.sqs_client = sqs_client
+        self.textract_client = textract_client
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.receives = 0
+        self.malformed = 0
+        self.unknown = 0
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages, WaitTimeSeconds):
+        self.receives += 1
+        response = self.sqs_client.receive_message(QueueUrl=QueueUrl, MaxNumberOfMessages=MaxNumberOfMessages)
+        if response.get('Messages'):
+            return response
+        wait = self.textract_client.next_finish()
+        self.clock.sleep(WaitTimeSeconds if wait is None else max(0, min(wait, WaitTimeSeconds)))
+        self.textract_client.publish_finished()
+        if self.random.random() < MALFORMED_MESSAGES:
+            self.malformed += 1
+            self.sqs_client.send_message(QueueUrl=QueueUrl, MessageBody='not a notification')
+        if self.random.random() < UNKNOWN_JOBS:
+            self.unknown += 1
+            self.sqs_client.send_message(QueueUrl=QueueUrl, MessageBody=json.dumps(
+                {'JobId': f"other-{self.unknown}", 'Status': 'SUCCEEDED'}))
+        return self.sqs_client.receive_message(QueueUrl=QueueUrl, MaxNumberOfMessages=MaxNumberOfMessages)
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        return self.sqs_client.delete_message_batch(QueueUrl=QueueUrl, Entries=Entries)
+
+
+def run(raw_delivery):
+    random.seed(0)  # retry jitter
+    clock = SimulatedClock()
+    sns_client = boto3.client('sns', region_name='us-east-1')
+    sqs_client = boto3.client('sqs', region_name='us-east-1')
+    topic_arn = sns_client.create_topic(Name=f"textract-{raw_delivery}")['TopicArn']
+    queue_url = sqs_client.create_queue(QueueName=f"textract-{raw_delivery}")['QueueUrl']
+    queue_arn = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    sns_client.subscribe(TopicArn=topic_arn, Protocol='sqs', Endpoint=queue_arn,
+                         Attributes={'RawMessageDelivery': 'true' if raw_delivery else 'false'})
+
+    textract_client = NotifyingTextractClient(clock, sns_client, topic_arn)
+    queue_client = SimulatedQueueClient(sqs_client, textract_client, clock)
+    documents = [f"waivers-raw-pdf/waiver-{i}.pdf" for i in range(DOCUMENTS)]
+
+    # Jobs of an earlier run, finished while no one was listening
+    resume = {}
+    for document in documents[:RESUMED]:
+        resume[document] = textract_client.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': 'bench', 'Name': document}})['JobId']
+        del textract_client.unpublished[resume[document]]
+    clock.sleep(60)
+    starts_before = textract_client.starts
+
+    saved = []
+    completed = run_textract_jobs_notified(
+        textract_client, queue_client, queue_url, documents[RESUMED:],
+        lambda document: textract_client.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': 'bench', 'Name': document}})['JobId'],
+        lambda document, job_id, response: saved.append(document),
+        max_in_flight=MAX_IN_FLIGHT, sweep_interval=SWEEP_INTERVAL, sleep=clock.sleep,
+        clock=lambda: clock.now, resume=resume)
+
+    assert sorted(saved) == sorted(documents), f"{len(saved)} saved, {len(set(saved))} distinct"
+    assert completed == DOCUMENTS
+    assert textract_client.starts - starts_before == DOCUMENTS - RESUMED
+    left = sqs_client.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['ApproximateNumberOfMessages'])
+    assert left['Attributes']['ApproximateNumberOfMessages'] == '0', "messages left in the queue"
+    return textract_client, queue_client, clock.now
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    print(f"{'delivery':>9} {'documents':>10} {'resumed':>8} {'lost':>5} {'malformed':>10} {'unknown':>8} "
+          f"{'receives':>9} {'get calls':>10} {'minutes':>8}")
+    with mock_aws():
+        for raw_delivery in (False, True):
+            textract_client, queue_client, seconds = run(raw_delivery)
+            print(f"{'raw' if raw_delivery else 'envelope':>9} {DOCUMENTS:>10} {RESUMED:>8} {textract_client.lost:>5} "
+                  f"{queue_client.malformed:>10} {queue_client.unknown:>8} {queue_client.receives:>9} "
+                  f"{textract_client.get_total:>10} {seconds / 60:>8.1f}")
@@ -0,0 +1,316 @@
+# Offline benchmark of the three stages, download -> Textract -> Excel, on a synthetic waiver corpus.
+# The waivers are generated from the checked-in Textract sample with varied names, addresses, dates and waived
+# regulations. FAA is a local HTTP stub serving generated PDFs, S3 is moto and Textract a fake client answering
+# with the generated responses, so the numbers are for comparing revisions, not AWS throughput.
+# Every corpus size runs in a process of its own. RSS is sampled while each stage runs, so the peak and the growth
+# of a stage (and of the workbook save, within the Excel stage) are its own, not what earlier stages left behind.
+# Run from project_files: python -m benchmarks.pipeline_benchmark [documents ...]
+import asyncio
+import contextlib
+import copy
+import functools
+import io
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from openpyxl import Workbook
+from PyPDF2 import PdfWriter
+from benchmarks.waiver_parser_benchmark import OPERATIONS, REGULATIONS, SAMPLE_PATH
+from utils.metrics import quantile
+from utils.module import string_remove
+
+SIZES = (100, 1000, 10000)
+PDFS_PER_PAGE = 100
+BUCKET = 'auvsi-uav-waivers'
+
+FIRST_NAMES = ["Seth", "Jane", "Carlos", "Li", "Ann", "Omar", "Priya", "Tom", "Maria", "Kofi", "Sven", "Aiko",
+               "Lucas", "Nina", "Raj", "Eva", "Sam", "Zoe", "Ivan", "Mia"]
+LAST_NAMES = ["Linder", "O'Neil", "Diaz-Rivera", "Wei", "Smith", "Haddad", "Patel", "Brown", "Garcia", "Mensah",
+              "Berg", "Tanaka", "Moreau", "Kowalski", "Shah", "Novak", "Lee", "Turner", "Petrov", "Rossi"]
+COMPANY_WORDS = ["Sky", "Aerial", "Eagle", "Drone", "Vista", "Summit", "Horizon", "Falcon", "Pixel", "Orbit"]
+COMPANY_SUFFIXES = ["LLC", "Inc.", "Media", "Aerial Services, LLC", "Imaging"]
+STREETS = ["Kendrick Ln", "Main St.", "Oak Ave", "Pine Rd", "Lakeview Dr", "Airport Blvd", "Elm St", "Ridge Way"]
+CITIES = [("Cumming", "GA", "30041"), ("Austin", "TX", "78701"), ("Boise", "ID", "83702"), ("Denver", "CO", "80202"),
+          ("Portland", "OR", "97201"), ("Tampa", "FL", "33602"), ("Columbus", "OH", "43215")]
+MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October",
+          "November", "December"]
+
+
+# Key of the n-th document, as the download stage stores it
+def document_key(index):
+    return f"waiver-{index:06d}"
+
+
+# The checked-in sample reduced to its PAGE and LINE blocks, without geometry. The WORD blocks are not read
+# by any stage and would only make moto hold gigabytes at 10k documents.
+def load_sample():
+    with open(SAMPLE_PATH) as f:
+        sample = json.load(f)
+    blocks = [{key: value for key, value in block.items() if key not in ('Geometry', 'Relationships')}
+              for block in sample['Blocks'] if block['BlockType'] in ('PAGE', 'LINE')]
+    return {'DocumentMetadata': sample['DocumentMetadata'], 'Blocks': blocks}
+
+
+# Textract response of the n-th waiver: the sample with generated page-1 lines, the same for the same index
+def make_response(sample, index):
+    generator = random.Random(index)
+    name = f"{generator.choice(FIRST_NAMES)} {generator.choice(LAST_NAMES)}"
+    company = name if generator.random() < 0.3 else \
+        f"{generator.choice(COMPANY_WORDS)} {generator.choice(COMPANY_WORDS)} {generator.choice(COMPANY_SUFFIXES)}"
+    city, state, zip_code = generator.choice(CITIES)
+    year = generator.randint(2016, 2024)
+    effective = f"{generator.choice(MONTHS)} {generator.randint(1, 28)}, {year}"
+    expire = f"{generator.choice(MONTHS)} {generator.randint(1, 28)}, {year + generator.randint(1, 4)}"
+    lines = ["U.S. DEPARTMENT OF TRANSPORTATION", "FEDERAL AVIATION ADMINISTRATION", "CERTIFICATE OF WAIVER",
+             "ISSUED TO", company, f"Responsible {generator.choice(['Person', 'Party'])}: {name}",
+             f"Waiver Number: 107W-{year}-{index:05d}", "ADDRESS -",
+             f"{generator.randint(1, 9999)} {generator.choice(STREETS)}", f"{city}, {state} {zip_code}",
+             string_remove["location"], "authority of this certificate except in accordance with the provisions.",
+             "OPERATIONS AUTHORIZED"]
+    lines += generator.sample(OPERATIONS, generator.randint(1, 3))
+    lines += ["LIST OF WAIVED REGULATIONS BY SECTION AND TITLE"]
+    lines += generator.sample(REGULATIONS, generator.randint(1, 4))
+    lines += ["STANDARD PROVISIONS", "1. A copy of the application made for this certificate shall be attached.",
+              f"This Certificate of Waiver is effective from {effective} to {expire}, and is subject to cancellation",
+              "BY DIRECTION OF THE ADMINISTRATOR"]
+    response = copy.deepcopy(sample)
+    page_lines = [block for block in response['Blocks'] if block['BlockType'] == 'LINE' and block['Page'] == 1]
+    for block, text in zip(page_lines, lines + [""] * len(page_lines)):
+        block['Text'] = text
+    return response
+
+
+# A small PDF, different for every index
+def make_pdf(index):
+    writer = PdfWriter()
+    writer.add_blank_page(612, 792)
+    writer.add_metadata({'/Title': document_key(index)})
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+# Stub of the FAA waivers_issued pages and PDF files, for documents PDFs
+class CorpusHandler(BaseHTTPRequestHandler):
+    documents = 0
+
+    def do_GET(self):
+        path = urlparse(self.path)
+        if path.path == '/waivers_issued':
+            pages = max(1, -(-self.documents // PDFS_PER_PAGE))
+            # Like the FAA site, pages past the end repeat the last page
+            page = min(int(parse_qs(path.query).get('page', ['0'])[0]), pages - 1)
+            indexes = range(page * PDFS_PER_PAGE, min((page + 1) * PDFS_PER_PAGE, self.documents))
+            links = "".join(f'<a href="/files/{document_key(index)}.pdf">Waiver</a>' for index in indexes)
+            self.respond(f"<html><body>{links}</body></html>".encode(), 'text/html')
+        elif path.path.startswith('/files/') and path.path.endswith('.pdf'):
+            self.respond(make_pdf(int(path.path.rsplit('-', 1)[1][:-len('.pdf')])), 'application/pdf')
+        else:
+            self.send_error(404)
+
+    def respond(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_corpus_server(documents):
+    handler = type('Handler', (CorpusHandler,), {'documents': documents})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# Textract stand-in: every job succeeds at once with the generated response of its document
+class CorpusTextractClient:
+    def __init__(self, sample):
+        self.sample = sample
+        self.jobs = {}
+
+    def start_document_text_detection(self, DocumentLocation, **kwargs):
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = DocumentLocation['S3Object']['Name']
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId, **kwargs):
+        index = int(os.path.splitext(self.jobs[JobId])[0].rsplit('-', 1)[1])
+        return dict(make_response(self.sample, index), JobStatus='SUCCEEDED')
+
+
+# An empty workbook with the header rows of the two sheets the Excel stage writes
+def make_workbook():
+    workbook = Workbook()
+    workbook.active.title = "Waiver Data"
+    workbook.active.append(["Operator ID", "Company ID", "Full Operator ID", "Effective Date", "Expire Date",
+                            "Waiver Number", "Waiver URL", "Daylight Operations", "VLOS Operations",
+                            "Visual Observer", "Multiple UAS", "Over People", "Operation in Certain Airspace",
+                            "Operating Limitations (a)", "Operating Limitations (b, c, d)",
+                            "Moving Vehicle or Aircraft", "Over Moving Vehicles", "Operations Authorized"])
+    workbook.create_sheet("Locations").append(["Operator ID", "Company ID", "Full Operator ID", "Responsible Person",
+                                               "Street", "City", "State", "Zip Code", "", "", "", "Company"])
+    output = io.BytesIO()
+    workbook.save(output)
+    return output.getvalue()
+
+
+# Current RSS of this process. Without /proc (not Linux) the peak so far is the best there is, so per-stage
+# peaks only go up there.
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# Samples the RSS of this process in a thread, keeping the peak since the start of the current window
+class RssSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.peak = rss_mb()
+        threading.Thread(target=self.sample, daemon=True).start()
+
+    def sample(self):
+        while True:
+            current = rss_mb()
+            with self.lock:
+                self.peak = max(self.peak, current)
+            time.sleep(self.interval)
+
+    # Measure a block: result gets the RSS at its start, its peak and the growth in between
+    @contextlib.contextmanager
+    def window(self, result):
+        start = rss_mb()
+        with self.lock:
+            self.peak = start
+        try:
+            yield
+        finally:
+            with self.lock:
+                peak = max(self.peak, rss_mb())
+            result.update({'start_rss_mb': start, 'peak_rss_mb': peak, 'rss_growth_mb': peak - start})
+
+
+# Per-document latency of a stage: the sum of its timings recorded for each document
+def document_latencies(metrics, stage):
+    totals = {}
+    for timing_stage, operation, document, seconds in metrics.timings:
+        if timing_stage == stage and document:
+            name = os.path.splitext(os.path.basename(document))[0]
+            totals[name] = totals.get(name, 0) + seconds
+    return sorted(totals.values())
+
+
+# Run the three stages on a corpus of the given size, in this process, and return their results
+def run(documents):
+    logging.disable(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    os.environ.update(AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark', AWS_REGION='us-east-1',
+                      AWS_DEFAULT_REGION='us-east-1', TEXTRACT_JOB_STORE=os.path.join(directory, 'jobs.db'),
+                      EXCEL_RECORD_STORE=os.path.join(directory, 'records.db'))
+    from moto import mock_aws
+    import utils.s3_cache
+    utils.s3_cache.cache_dir = os.path.join(directory, 's3-cache')
+
+    results = []
+    save_rss = {}
+    sampler = RssSampler()
+    server = start_corpus_server(documents)
+    with mock_aws(), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import boto3
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        s3.put_object(Bucket=BUCKET, Key='waivers_info.xlsx', Body=make_workbook())
+
+        import jsontoexcelcloud
+        import pdfdownloadcloud
+        import textractactioncloud
+        from utils.metrics import metrics
+        from utils.scheduler import run_textract_jobs
+
+        def stage(name, func):
+            result = {'stage': name}
+            start = time.perf_counter()
+            with sampler.window(result):
+                func()
+            result.update({'seconds': time.perf_counter() - start, 'latencies': document_latencies(metrics, name)})
+            results.append(result)
+
+        # The workbook save is measured on its own too, within the Excel stage
+        save_workbook = jsontoexcelcloud.WaiverWorkbook.save
+
+        def measured_save(waiver_workbook):
+            with sampler.window(save_rss):
+                save_workbook(waiver_workbook)
+
+        jsontoexcelcloud.WaiverWorkbook.save = measured_save
+
+        def download():
+            pdfdownloadcloud.url = f"http://127.0.0.1:{server.server_address[1]}/waivers_issued"
+            asyncio.run(pdfdownloadcloud.sync_all_pdfs())
+
+        def textract():
+            textractactioncloud.textract_client = CorpusTextractClient(load_sample())
+            # Jobs finish at once, so there is nothing to wait for between polls
+            textractactioncloud.run_textract_jobs = functools.partial(run_textract_jobs, min_poll_delay=0)
+            textractactioncloud.process_documents(textractactioncloud.bucket_name, textractactioncloud.subfolder)
+
+        def excel():
+            processed_count = jsontoexcelcloud.update_workbook()
+            assert processed_count == documents, f"{processed_count} of {documents} waivers written"
+
+        stage('download', download)
+        stage('textract', textract)
+        stage('excel', excel)
+        summary = metrics.summary()['timings']
+        workbook = {name: summary.get(f"excel.{name}", {}).get('total', 0)
+                    for name in ('workbook_load', 'locations_lookup', 'workbook_save')}
+    server.shutdown()
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return {'documents': documents, 'stages': results, 'workbook': workbook, 'workbook_save_rss': save_rss,
+            'children_peak_rss_mb': children_rss}
+
+
+# Run every size in a fresh interpreter and print one table
+def main(sizes):
+    print(f"{'documents':>9} {'stage':>9} {'seconds':>8} {'docs/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'peak RSS MB':>12} "
+          f"{'growth MB':>10}")
+    for documents in sizes:
+        completed = subprocess.run([sys.executable, '-m', 'benchmarks.pipeline_benchmark', '--run', str(documents)],
+                                   capture_output=True, text=True)
+        if completed.returncode:
+            sys.exit(completed.stderr)
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        for stage in result['stages']:
+            latencies = stage['latencies'] or [0]
+            print(f"{documents:>9} {stage['stage']:>9} {stage['seconds']:>8.1f} {documents / stage['seconds']:>8.1f} "
+                  f"{quantile(latencies, 0.5) * 1000:>8.1f} {quantile(latencies, 0.99) * 1000:>8.1f} "
+                  f"{stage['peak_rss_mb']:>12.0f} {stage['rss_growth_mb']:>10.0f}")
+        workbook = result['workbook']
+        save_rss = result['workbook_save_rss']
+        print(f"{documents:>9} workbook load {workbook['workbook_load']:.2f}s, locations matching "
+              f"{workbook['locations_lookup']:.2f}s, save {workbook['workbook_save']:.2f}s "
+              f"(peak RSS {save_rss['peak_rss_mb']:.0f} MB, +{save_rss['rss_growth_mb']:.0f} MB); "
+              f"parse workers peak RSS {result['children_peak_rss_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        print(json.dumps(run(int(sys.argv[2]))))
+    else:
+        main([int(argument) for argument in sys.argv[1:]] or SIZES)
@@ -0,0 +1,141 @@
+# Crash-and-resume check of textractactioncloud.process_documents with the simulated Textract client of
+# scheduler_benchmark, on moto S3. The stage is killed at random points, also between a job start and its
+# JobStore record, and run again until every document is saved, like a recycled container would. Some jobs fail
+# and are started again by a later run. With the job store and the ClientRequestToken of every start, each
+# document is billed one job per attempt, and its result is saved once. Needs moto.
+# Run from project_files: python -m benchmarks.resume_benchmark
+import functools
+import logging
+import os
+import random
+import tempfile
+from botocore.exceptions import ClientError
+from benchmarks.pipeline_benchmark import make_pdf
+from benchmarks.scheduler_benchmark import API_LATENCY, FakeTextractClient, SimulatedClock
+
+DOCUMENTS = 200
+CRASH_EVERY = (30, 120)     # simulated seconds between crashes
+FAIL_EVERY = 25             # the first job of every n-th document fails
+CRASH_AFTER_START = 0.03    # chance of a crash between a new job and the start response
+MAX_RUNS = 100
+
+
+class Crash(BaseException):
+    pass
+
+
+class CrashingClock(SimulatedClock):
+    def __init__(self, seed=0):
+        super().__init__()
+        self.random = random.Random(seed)
+        self.crash_at = None
+
+    def arm(self):
+        self.crash_at = self.now + self.random.uniform(*CRASH_EVERY)
+
+    def sleep(self, seconds):
+        super().sleep(seconds)
+        if self.crash_at is not None and self.now >= self.crash_at:
+            self.crash_at = None
+            raise Crash()
+
+
+# Answers a start with a ClientRequestToken it has seen with the JobId of that job, like Textract, and forgets
+# nothing: jobs do not expire within the check. The first job of every FAIL_EVERY-th document fails, and some
+# start responses never arrive because the stage crashed while waiting for them.
+class ResumableTextractClient(FakeTextractClient):
+    def __init__(self, clock, seed=0):
+        super().__init__(clock)
+        self.crashes = random.Random(seed + 1)
+        self.tokens = {}
+        self.documents = {}         # JobId -> document
+        self.failing = set()        # JobIds which end FAILED
+        self.start_calls = 0
+        self.lost_responses = 0
+
+    def start_document_text_detection(self, DocumentLocation, ClientRequestToken=None, **kwargs):
+        self.start_calls += 1
+        if ClientRequestToken in self.tokens:
+            self.clock.sleep(API_LATENCY)
+            return {'JobId': self.tokens[ClientRequestToken]}
+        document = DocumentLocation['S3Object']['Name']
+        job_id = super().start_document_text_detection(DocumentLocation)['JobId']
+        if ClientRequestToken:
+            self.tokens[ClientRequestToken] = job_id
+        index = int(os.path.splitext(document)[0].rsplit('-', 1)[1])
+        if index % FAIL_EVERY == 0 and document not in self.documents.values():
+            self.failing.add(job_id)
+        self.documents[job_id] = document
+        # A crash here leaves a running job the stage has not recorded
+        if self.crashes.random() < CRASH_AFTER_START:
+            self.lost_responses += 1
+            raise Crash()
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId, **kwargs):
+        if JobId not in self.jobs:
+            raise ClientError({'Error': {'Code': 'InvalidJobIdException', 'Message': 'Invalid job id'}},
+                              'GetDocumentTextDetection')
+        response = super().get_document_text_detection(JobId)
+        if response['JobStatus'] == 'SUCCEEDED' and JobId in self.failing:
+            return {'JobStatus': 'FAILED', 'StatusMessage': 'Simulated failure'}
+        return response
+
+
+# Run the Textract stage, crashing it at random points, until every document is saved
+def run():
+    random.seed(0)  # retry jitter
+    directory = tempfile.mkdtemp()
+    os.environ.update(AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark', AWS_REGION='us-east-1',
+                      AWS_DEFAULT_REGION='us-east-1', TEXTRACT_JOB_STORE=os.path.join(directory, 'jobs.db'),
+                      S3_CACHE_SIZE_MB='0')
+    from moto import mock_aws
+    with mock_aws():
+        import boto3
+        s3 = boto3.client('s3')
+        import textractactioncloud as textract
+        from utils.job_store import resumable_jobs
+        from utils.scheduler import run_textract_jobs
+
+        s3.create_bucket(Bucket=textract.bucket_name)
+        documents = [f"{textract.subfolder}/waiver-{i}.pdf" for i in range(DOCUMENTS)]
+        for index, document in enumerate(documents):
+            s3.put_object(Bucket=textract.bucket_name, Key=document, Body=make_pdf(index))
+
+        clock = CrashingClock()
+        client = ResumableTextractClient(clock)
+        textract.textract_client = client
+        textract.run_textract_jobs = functools.partial(run_textract_jobs, sleep=clock.sleep)
+        textract.resumable_jobs = functools.partial(resumable_jobs, sleep=clock.sleep)
+        saved = []
+        runs = crashes = 0
+        while len(set(saved)) < len(documents):
+            assert runs < MAX_RUNS, f"{len(set(saved))} of {DOCUMENTS} documents saved after {runs} runs"
+            runs += 1
+            # Every run starts like a fresh process: the job store is reopened and the listings read again
+            textract.job_store.close()
+            textract.existing_results.reset()
+            textract.pdf_validations.reset()
+            clock.arm()
+            try:
+                textract.process_documents(textract.bucket_name, textract.subfolder,
+                                           on_saved=lambda document, result_key: saved.append(document))
+            except Crash:
+                crashes += 1
+        textract.job_store.close()
+
+    failed = len(client.failing)
+    assert sorted(saved) == sorted(documents), f"{len(saved)} results saved for {DOCUMENTS} documents"
+    assert len(client.jobs) == DOCUMENTS + failed, f"{len(client.jobs)} jobs billed for {DOCUMENTS} documents"
+    return {'runs': runs, 'crashes': crashes, 'lost_responses': client.lost_responses, 'failed': failed,
+            'start_calls': client.start_calls, 'jobs': len(client.jobs), 'seconds': clock.now}
+
+
+if __name__ == '__main__':
+    # The simulated failures are logged as errors
+    logging.disable(logging.CRITICAL)
+    result = run()
+    print(f"{'runs':>5} {'crashes':>8} {'lost starts':>12} {'documents':>10} {'failed jobs':>12} {'start calls':>12} "
+          f"{'jobs billed':>12} {'minutes':>8}")
+    print(f"{result['runs']:>5} {result['crashes']:>8} {result['lost_responses']:>12} {DOCUMENTS:>10} "
+          f"{result['failed']:>12} {result['start_calls']:>12} {result['jobs']:>12} {result['seconds'] / 60:>8.1f}")
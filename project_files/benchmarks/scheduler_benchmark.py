@@ -0,0 +1,72 @@
+# Benchmark for utils.scheduler.run_textract_jobs against a mocked Textract client.
+# Time is simulated, so the benchmark runs in seconds and is fully deterministic.
+# Run from project_files: python -m benchmarks.scheduler_benchmark
+import logging
+import random
+from botocore.exceptions import ClientError
+from utils.scheduler import run_textract_jobs
+
+DOCUMENTS = 200
+JOB_SECONDS = (15, 45)      # how long Textract needs for one document
+API_LATENCY = 0.1           # round trip of a single API call
+GET_RATE_LIMIT = 10         # get_document_text_detection calls allowed per second
+CONCURRENCY_LEVELS = (1, 2, 5, 10, 25, 50)
+
+
+class SimulatedClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeTextractClient:
+    def __init__(self, clock, seed=0):
+        self.clock = clock
+        self.random = random.Random(seed)
+        self.jobs = {}
+        self.get_calls = []
+
+    def start_document_text_detection(self, DocumentLocation):
+        self.clock.sleep(API_LATENCY)
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = self.clock.now + self.random.uniform(*JOB_SECONDS)
+        return {'JobId': job_id}
+
+    def get_document_text_detection(self, JobId):
+        self.clock.sleep(API_LATENCY)
+        # Throttle like Textract does when the per-second quota is exceeded
+        self.get_calls = [t for t in self.get_calls if t > self.clock.now - 1]
+        if len(self.get_calls) >= GET_RATE_LIMIT:
+            raise ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Throttled'}},
+                              'GetDocumentTextDetection')
+        self.get_calls.append(self.clock.now)
+        if self.clock.now < self.jobs[JobId]:
+            return {'JobStatus': 'IN_PROGRESS'}
+        return {'JobStatus': 'SUCCEEDED', 'Blocks': []}
+
+
+def run(max_in_flight):
+    random.seed(0)  # retry jitter
+    clock = SimulatedClock()
+    client = FakeTextractClient(clock)
+    documents = [f"waivers-raw-pdf/waiver-{i}.pdf" for i in range(DOCUMENTS)]
+    completed = run_textract_jobs(
+        client,
+        documents,
+        lambda document: client.start_document_text_detection(
+            DocumentLocation={'S3Object': {'Bucket': 'bench', 'Name': document}})['JobId'],
+        lambda document, job_id, response: None,
+        max_in_flight=max_in_flight,
+        sleep=clock.sleep
+    )
+    return completed, clock.now
+
+
+if __name__ == '__main__':
+    logging.disable(logging.WARNING)
+    print(f"{'in flight':>10} {'documents':>10} {'minutes':>10} {'docs/minute':>12}")
+    for max_in_flight in CONCURRENCY_LEVELS:
+        completed, seconds = run(max_in_flight)
+        print(f"{max_in_flight:>10} {completed:>10} {seconds / 60:>10.1f} {completed / (seconds / 60):>12.1f}")
@@ -0,0 +1,63 @@
+# Parity check and micro-benchmark for utils.module.check_waiver_codes against the
+# per-code regex loop it replaced. Run from project_files: python -m benchmarks.waiver_codes_benchmark
+import random
+import re
+import time
+from utils.module import check_waiver_codes, waiver_codes
+
+CORPUS_SIZE = 20000
+
+# Hand-picked edge cases: OCR prefix, 107.51(a) vs (b|c|d), digits around the codes
+EDGE_CASES = [
+    "",
+    "14 CFR § 07.51(b)-Operating limitations for small unmanned aircraft - Altitude",
+    "14 CFR § 107.51(a) - Operating limitations - Ground speed",
+    "107.51(a) 107.51(c) 107.51(d) 107.51(e) 107.51",
+    "2107.51(b) 1107.29 107.290 107.29.1 07.29a",
+    "107.25(b) 107.25(c) 107.25 107.145 107.1450 107.14",
+    "107.29107.31 107.3107.33 (107.35) 107.39, 107.41;",
+    "§ 107.31 Visual line of sight aircraft operation; § 107.33 Visual observer; § 107.35 Operation of multiple small UAS",
+]
+
+PARTS = ["107.", "07.", "1", "0", "7", ".", "29", "31", "33", "35", "39", "41", "51", "(a)", "(b)", "(c)", "(d)",
+         "25", "145", " ", "§ ", "14 CFR ", "-", ", ", "Operating limitations", "Daylight operation"]
+
+
+# The implementation before the single-pass matcher, kept for the parity check
+def legacy_check_waiver_codes(entry):
+    result = {name: '' for name in waiver_codes.values()}
+    for code, name in waiver_codes.items():
+        if code == "107.51":
+            pattern = re.compile(r'(107|07)\.51\((b|c|d)\)')
+        else:
+            pattern = re.compile(r'(?<!\d)(107|07)\.' + re.escape(code[4:]).replace(r'\.', r'\.') + r'(?!\d)')
+        if pattern.search(entry):
+            result[name] = '+'
+    return result
+
+
+def build_corpus(size, seed=0):
+    generator = random.Random(seed)
+    corpus = list(EDGE_CASES)
+    while len(corpus) < size:
+        corpus.append("".join(generator.choice(PARTS) for _ in range(generator.randint(1, 60))))
+    return corpus
+
+
+def timed(func, corpus):
+    start = time.perf_counter()
+    for entry in corpus:
+        func(entry)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    corpus = build_corpus(CORPUS_SIZE)
+    mismatches = [entry for entry in corpus if check_waiver_codes(entry) != legacy_check_waiver_codes(entry)]
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} mismatches, first: {mismatches[0]!r}")
+    print(f"Parity: {len(corpus)} strings, identical results")
+    legacy = timed(legacy_check_waiver_codes, corpus)
+    current = timed(check_waiver_codes, corpus)
+    print(f"legacy:      {len(corpus) / legacy:>10.0f} strings/second")
+    print(f"single pass: {len(corpus) / current:>10.0f} strings/second ({legacy / current:.1f}x)")
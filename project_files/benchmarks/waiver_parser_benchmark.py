@@ -0,0 +1,219 @@
+# Parity check and benchmark for utils.module.WaiverParser against the keyword cascade it replaced.
+# The corpus is made of variants of the checked-in Textract sample.
+# Run from project_files: python -m benchmarks.waiver_parser_benchmark
+import copy
+import json
+import os
+import random
+import re
+import time
+from dateutil import parser
+from utils.module import convert_state_code_to_name, extract_final_info, string_remove, strip_and_merge
+from utils.textract_results import collect_lines
+
+SAMPLE_PATH = os.path.join(os.path.dirname(__file__), '..', '..', 'textract_results', 'textract_result_sample.json')
+VARIANTS = 300
+
+NAMES = ["Seth Linder", "Jane O'Neil", "Carlos Diaz-Rivera", "Li Wei", "Ann Smith"]
+COMPANIES = ["MachShots.com", "Acme Aerial, LLC", "Sky Eye Inc.", None]  # None: issued to the responsible person
+ADDRESSES = [
+    ["5706 Kendrick Ln", "Cumming, GA 30041"],
+    ["100 Main St.", "Suite 200", "Austin, TX 78701"],
+    ["PO Box 12", "Boise, ID 83702"],
+]
+DATES = [("October 4, 2024", "October 20, 2024"), ("January 1, 2023", "December 31, 2026"), ("May 5, 2022", "May 4, 2024")]
+REGULATIONS = ["14 CFR § 107.29(a)(2) and (b) - Daylight operation", "14 CFR § 107.31 - Visual line of sight aircraft operation",
+               "14 CFR § 07.51(b)-Operating limitations for small unmanned aircraft - Altitude",
+               "14 CFR § 107.39 - Operations over human beings", "14 CFR § 107.145 - Operations over moving vehicles"]
+OPERATIONS = ["sUAS operations higher than 400 feet above ground level.", "Operations over people.",
+              "Night operations in Class G airspace.", "Operations beyond visual line of sight."]
+
+
+# The implementation before WaiverParser, kept for the parity check
+def legacy_extract_final_info(blocks, key):
+    info = {
+        "Issued To": "",
+        "Responsible Person": "",
+        "Address": "",
+        "Street Name and Number": "",
+        "City": "",
+        "State": "",
+        "Zip Code": "",
+        "Waiver Number": "",
+        "Operations Authorized": "",
+        "List of Waived Regulations": "",
+        "Effective Date": "",
+        "Expire Date": "",
+        "Waiver URL": ""
+    }
+
+    capture_next = False
+    address_line_count = 0
+
+    info["Waiver URL"] = key.replace("json", "pdf").replace("waivers-pdf", "https://www.faa.gov/sites/faa.gov/files/")
+
+    for block in blocks:
+        if block['BlockType'] == 'LINE' and block['Page'] == 1:
+            text = block['Text']
+
+            if "ISSUED TO" in text:
+                capture_next = "Issued To"
+            elif "ADDRESS" in text:
+                capture_next = "Address"
+                address_line = [""] * 3
+                address_line_count = 0
+            elif "Responsible Person:" in text:
+                info["Responsible Person"] = text.split(":", 1)[1].strip()
+            elif "Responsible Party:" in text:
+                info["Responsible Person"] = text.split(":", 1)[1].strip()
+            elif "Waiver Number:" in text:
+                info["Waiver Number"] = text.split(":", 1)[1].strip()
+            elif "OPERATIONS AUTHORIZED" in text:
+                capture_next = "Operations Authorized"
+                info[capture_next] = ""  # Initialize as empty to append lines
+            elif "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE" in text:
+                capture_next = "List of Waived Regulations"
+                info[capture_next] = ""  # Initialize as empty to append lines
+            elif "effective from" in text.lower():
+                date_parts = text.split("effective from", 1)[1].split(" to ", 1)
+                if len(date_parts) == 2:
+                    start_date = parser.parse(date_parts[0].strip())
+                    end_date = parser.parse(date_parts[1].strip().split(",")[0].strip())
+                    info["Effective Date"] = start_date.strftime('%m/%d/%Y')
+                    info["Expire Date"] = end_date.strftime('%m/%d/%Y')
+
+            elif capture_next:
+                if capture_next == "Address":
+                    address_line[address_line_count] += (text + " ") if address_line_count < 3 else ""
+                    address_line_count += 1
+                    if address_line_count == 3:
+                        info[capture_next] = strip_and_merge(address_line)
+                        capture_next = False
+                        address_components = info["Address"]  # get_address(info["Address"])
+                        if address_components:
+                            if len(address_line[2]) > 40:  # Case when we have three-row address
+                                street_and_number, rest = address_components.split("/", 1)
+                                cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
+                                # Replace multiple spaces with a single space
+                                info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
+                                info["City"], rest = rest.split(",", 1)
+                                state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest)
+
+                                if state_zip:
+                                    info["State"] = convert_state_code_to_name(state_zip.group(1))
+                                    info["Zip Code"] = state_zip.group(2)
+                                else:
+                                    state = zip_code = None
+                            else:
+                                street_and_number = address_line[0] + '/' + address_line[1]
+                                cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
+                                # Replace multiple spaces with a single space
+                                info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
+
+                                city_state_zip = address_line[2]
+                                info["City"], rest = city_state_zip.split(",", 1)
+                                state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest.strip())
+                                if state_zip:
+                                    info["State"] = convert_state_code_to_name(state_zip.group(1))
+                                    info["Zip Code"] = state_zip.group(2)
+                                else:
+                                    info["State"] = None
+                                    info["Zip Code"] = None
+                        else:
+                            # Handle the case where address_components is None
+                            info["Street Name and Number"] = "Unknown"
+                            info["City"] = "Unknown"
+                            info["State"] = "Unknown"
+                            info["Zip Code"] = "Unknown"
+
+                elif capture_next == "List of Waived Regulations":
+                    # Append each new line to the List of Waived Regulations
+                    info[capture_next] += text + " "
+                    # Continue capturing until a new section starts
+                    if any (keyword in text for keyword in ["STANDARD PROVISIONS"]):
+                        capture_next = False
+                elif capture_next == "Operations Authorized":
+                    # Append each new line to the List of Waived Regulations
+                    info[capture_next] += text + " "
+                    # Continue capturing until a new section starts
+                    if any (keyword in text for keyword in ["LIST OF WAIVED REGULATIONS BY SECTION AND TITLE"]):
+                        capture_next = False
+                else:
+                    info[capture_next] = text
+                    capture_next = False
+
+    for key in info.keys():
+        info[key] = info[key].strip()
+
+    # Remove 'STANDARD PROVISIONS' from the final output if it was appended
+    if "STANDARD PROVISIONS" in info["List of Waived Regulations"]:
+        info["List of Waived Regulations"] = info["List of Waived Regulations"].replace("STANDARD PROVISIONS",
+                                                                                        "").strip()
+
+    # Remove 'LIST OF WAIVED REGULATIONS BY SECTION AND TITLE' from the final output if it was appended
+    if "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE" in info["Operations Authorized"]:
+        info["Operations Authorized"] = info["Operations Authorized"].replace(
+            "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE", "").strip()
+
+    # Remove redundant string from ["Address"]
+    if string_remove["location"] in info["Address"]:
+        info["Address"] = info["Address"].replace(
+            string_remove["location"], "").strip()
+
+    return info
+
+
+# Replace the text of the page-1 LINE blocks of the sample with a generated waiver
+def make_variant(sample, generator):
+    name = generator.choice(NAMES)
+    company = generator.choice(COMPANIES) or name
+    effective, expire = generator.choice(DATES)
+    lines = ["U.S. DEPARTMENT OF TRANSPORTATION", "FEDERAL AVIATION ADMINISTRATION", "CERTIFICATE OF WAIVER",
+             "ISSUED TO", company, f"Responsible {generator.choice(['Person', 'Party'])}: {name}",
+             f"Waiver Number: 107W-{generator.randint(2016, 2024)}-{generator.randint(0, 99999):05d}", "ADDRESS -"]
+    lines += generator.choice(ADDRESSES)
+    lines += [string_remove["location"], "authority of this certificate except in accordance with the provisions.",
+              "OPERATIONS AUTHORIZED"]
+    lines += generator.sample(OPERATIONS, generator.randint(1, 3))
+    lines += ["LIST OF WAIVED REGULATIONS BY SECTION AND TITLE"]
+    lines += generator.sample(REGULATIONS, generator.randint(1, 4))
+    lines += ["STANDARD PROVISIONS", "1. A copy of the application made for this certificate shall be attached.",
+              f"This Certificate of Waiver is effective from {effective} to {expire}, and is subject to cancellation",
+              "BY DIRECTION OF THE ADMINISTRATOR"]
+    variant = copy.deepcopy(sample)
+    page_lines = [block for block in variant['Blocks'] if block['BlockType'] == 'LINE' and block['Page'] == 1]
+    for block, text in zip(page_lines, lines + [""] * len(page_lines)):
+        block['Text'] = text
+    return variant
+
+
+def timed(func, corpus):
+    start = time.perf_counter()
+    for blocks in corpus:
+        func(blocks, "waivers-json/waiver.json")
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    with open(SAMPLE_PATH) as f:
+        sample = json.load(f)
+    generator = random.Random(0)
+    raw_corpus = [sample['Blocks']] + [make_variant(sample, generator)['Blocks'] for _ in range(VARIANTS)]
+    compact_corpus = []
+    for blocks in raw_corpus:
+        lines = []
+        list(collect_lines([{'Blocks': blocks}], lines))
+        compact_corpus.append(lines)
+
+    for blocks in raw_corpus + compact_corpus:
+        expected = legacy_extract_final_info(blocks, "waivers-json/waiver.json")
+        if extract_final_info(blocks, "waivers-json/waiver.json") != expected:
+            raise SystemExit(f"Mismatch for waiver {expected['Waiver Number']}")
+    print(f"Parity: {len(raw_corpus) + len(compact_corpus)} documents, identical results")
+
+    page_lines = sum(len(lines) for lines in compact_corpus)
+    for label, corpus in (("raw Textract JSON", raw_corpus), ("compact LINE object", compact_corpus)):
+        legacy = timed(legacy_extract_final_info, corpus)
+        current = timed(extract_final_info, corpus)
+        print(f"{label}: legacy {page_lines / legacy:>9.0f} lines/second, "
+              f"WaiverParser {page_lines / current:>9.0f} lines/second ({legacy / current:.1f}x)")
@@ -0,0 +1,131 @@
+# Parity check and benchmark of the three workbook output modes of jsontoexcelcloud (EXCEL_OUTPUT_MODE).
+# Every mode adds the same synthetic waivers to the same workbook, on moto S3, and must save the same cell values.
+# The workbook has external-link formulas, plain and inside a function, in the written sheets and in another one,
+# which every mode has to strip, and a Waiver Data sheet whose dimension goes past its last stored row, as Excel
+# leaves it for formatted empty rows.
+# Run from project_files: python -m benchmarks.workbook_benchmark [documents]
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import zipfile
+from openpyxl import load_workbook
+from benchmarks.pipeline_benchmark import BUCKET, load_sample, make_response, make_workbook
+from utils.workbook import EXTERNAL_REFERENCE
+
+DOCUMENTS = 200
+MODES = ('workbook', 'streaming', 'store')
+EXISTING_WAIVERS = 5
+EXTRA_DIMENSION_ROWS = 40
+
+
+# The header-only workbook of pipeline_benchmark with a few existing waivers, external links and an extra sheet
+def make_existing_workbook():
+    workbook = load_workbook(io.BytesIO(make_workbook()))
+    waiver_data = workbook["Waiver Data"]
+    for index in range(EXISTING_WAIVERS):
+        waiver_data.append([index + 1, "INDIVIDUAL", f"{index + 1}-INDIVIDUAL", None, None, f"107W-OLD-{index}"])
+    waiver_data.cell(row=2, column=7, value="=[1]Sheet1!A1")
+    workbook["Locations"].append([1, "INDIVIDUAL", "1-INDIVIDUAL", "Someone", "1 Main St.", "Boise", "ID", "83702"])
+    workbook["Locations"].cell(row=2, column=9, value="=SUM([1]Sheet1!A1:A3)")
+    notes = workbook.create_sheet("Notes")
+    notes.append(["kept", "=[1]Sheet1!B2", "=1+2", "=VLOOKUP(A1,[2]Lookup!A:B,2,FALSE)"])
+    output = io.BytesIO()
+    workbook.save(output)
+    return extend_dimension(output.getvalue(), "xl/worksheets/sheet1.xml", EXTRA_DIMENSION_ROWS)
+
+
+# Make the dimension of a worksheet part cover rows more empty rows than are stored
+def extend_dimension(body, part, rows):
+    source = zipfile.ZipFile(io.BytesIO(body))
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED) as target:
+        for name in source.namelist():
+            data = source.read(name)
+            if name == part:
+                start = data.index(b'<dimension ref="') + len(b'<dimension ref="')
+                end = data.index(b'"', start)
+                first, last = data[start:end].decode().split(':')
+                column = last.rstrip('0123456789')
+                last_row = int(last[len(column):]) + rows
+                data = data[:start] + f"{first}:{column}{last_row}".encode() + data[end:]
+            target.writestr(name, data)
+    return output.getvalue()
+
+
+# Cell values of every sheet, without trailing empty cells and rows, which the modes are free to leave out
+def workbook_values(body):
+    workbook = load_workbook(io.BytesIO(body))
+    values = {}
+    for sheet in workbook.worksheets:
+        rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+        for row in rows:
+            while row and row[-1] is None:
+                row.pop()
+        while rows and not rows[-1]:
+            rows.pop()
+        values[sheet.title] = rows
+    return values
+
+
+# External-link formulas left in the saved workbook, as (sheet, row, column, formula)
+def external_links(values):
+    return [(title, row_number, column, value)
+            for title, rows in values.items()
+            for row_number, row in enumerate(rows, start=1)
+            for column, value in enumerate(row, start=1)
+            if isinstance(value, str) and value.startswith('=') and EXTERNAL_REFERENCE.search(value)]
+
+
+def main(documents):
+    logging.disable(logging.WARNING)
+    directory = tempfile.mkdtemp()
+    os.environ.update(AWS_ACCESS_KEY_ID='benchmark', AWS_SECRET_ACCESS_KEY='benchmark', AWS_REGION='us-east-1',
+                      AWS_DEFAULT_REGION='us-east-1', EXCEL_RECORD_STORE=os.path.join(directory, 'records.db'))
+    from moto import mock_aws
+    import utils.s3_cache
+    utils.s3_cache.cache_dir = os.path.join(directory, 's3-cache')
+
+    existing = make_existing_workbook()
+    sample = load_sample()
+    results = {}
+    with mock_aws(), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import boto3
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket=BUCKET)
+        for index in range(documents):
+            s3.put_object(Bucket=BUCKET, Key=f"waivers-json/waiver-{index:06d}.json",
+                          Body=json.dumps(make_response(sample, index)).encode('utf-8'))
+
+        import jsontoexcelcloud
+        for mode in MODES:
+            # Every mode starts from the same workbook, without a ledger or record store of an earlier mode
+            s3.put_object(Bucket=BUCKET, Key=jsontoexcelcloud.output_file_key, Body=existing)
+            for key in (jsontoexcelcloud.ledger_file_key, jsontoexcelcloud.record_store_key):
+                s3.delete_object(Bucket=BUCKET, Key=key)
+            jsontoexcelcloud.output_mode = mode
+            start = time.perf_counter()
+            processed_count = jsontoexcelcloud.update_workbook(parse_workers=0)
+            seconds = time.perf_counter() - start
+            assert processed_count == documents, f"{mode}: {processed_count} of {documents} waivers written"
+            body = s3.get_object(Bucket=BUCKET, Key=jsontoexcelcloud.output_file_key)['Body'].read()
+            results[mode] = {'seconds': seconds, 'size': len(body), 'values': workbook_values(body)}
+
+    print(f"{'mode':>10} {'seconds':>8} {'size KB':>8} {'rows':>6}  same values as 'workbook'")
+    for mode, result in results.items():
+        links = external_links(result['values'])
+        assert not links, f"{mode}: external links left in the workbook: {links[:3]}"
+        same = result['values'] == results['workbook']['values']
+        print(f"{mode:>10} {result['seconds']:>8.2f} {result['size'] / 1024:>8.0f} "
+              f"{len(result['values']['Waiver Data']):>6}  {'yes' if same else 'NO'}")
+    for mode, result in results.items():
+        for title, rows in results['workbook']['values'].items():
+            assert result['values'][title] == rows, f"{mode}: the {title} sheet differs from the workbook mode"
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if sys.argv[1:] else DOCUMENTS)
@@ -0,0 +1,174 @@
+# AWS Lambda entry points of the waiver pipeline.
+# - download_handler, textract_handler, excel_handler: one stage over the whole bucket, like the scripts,
+#   for scheduled invocations
+# - textract_document_handler: Textract for the PDFs of an S3 ObjectCreated event under waivers-raw-pdf/
+# - textract_completion_handler: saves the result of a finished job, from the SNS topic passed as
+#   NotificationChannel (subscribed directly or through SQS)
+# - parse_document_handler: parses the results of an S3 ObjectCreated event under waivers-json/ into
+#   waivers-parsed/, where excel_handler picks them up instead of parsing them again
+# The per-document handlers let Lambda fan out one invocation per document.
+# A stage module is imported by the first invocation which needs it, so a handler only loads the libraries,
+# clients and state of its own stage. This does not make a cold start much cheaper: every stage needs boto3,
+# which takes most of the import time (see benchmarks/import_benchmark.py). The module, with its boto3 clients,
+# HTTP session and caches, then stays loaded for the warm invocations of the same container.
+import json
+import os
+import sys
+import time
+from urllib.parse import unquote_plus
+
+# The stage modules import their helpers as the top-level utils package, like when they run as scripts
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Lambda can only write to /tmp, and its /tmp is 512 MB by default: the S3 cache, 256 MB unless S3_CACHE_SIZE_MB
+# says otherwise, fits there next to these stores. Set before the stage modules read them.
+os.environ.setdefault('TEXTRACT_JOB_STORE', '/tmp/textract-jobs.db')
+os.environ.setdefault('EXCEL_RECORD_STORE', '/tmp/waivers-records.db')
+# Lambda has no /dev/shm, which multiprocessing needs: waivers are parsed in the fetch threads
+os.environ.setdefault('EXCEL_PARSE_WORKERS', '0')
+
+from utils.metrics import metrics
+
+# Bucket, key and ETag of every object of an S3 event notification, delivered directly or through SQS
+def s3_event_objects(event):
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            yield from s3_event_objects(json.loads(record['body']))
+            continue
+        s3_object = record['s3']['object']
+        # Keys are URL-encoded in event notifications, and ETags come without their quotes
+        yield {'Bucket': record['s3']['bucket']['name'], 'Key': unquote_plus(s3_object['key']),
+               'ETag': f'"{s3_object["eTag"]}"' if s3_object.get('eTag') else None}
+
+# Body of every SNS message of an event, delivered directly or through SQS
+def sns_messages(event):
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            yield record['body']
+        else:
+            yield record['Sns']['Message']
+
+# Write the run report of an invocation, if METRICS_REPORT or METRICS_PROMETHEUS is set
+def write_reports(module):
+    metrics.write_reports(module.metrics_report, module.metrics_prometheus)
+
+# Crawl the FAA pages and download the new PDFs
+def download_handler(event, context):
+    import asyncio
+    import pdfdownloadcloud
+
+    metrics.reset()
+    # Listed and loaded again per invocation, another container may have downloaded files since
+    pdfdownloadcloud.existing_pdfs.reset()
+    pdfdownloadcloud.manifest.clear()
+    downloaded = asyncio.run(pdfdownloadcloud.sync_all_pdfs())
+    write_reports(pdfdownloadcloud)
+    return {'downloaded': len(downloaded)}
+
+# Run Textract on every PDF without a result
+def textract_handler(event, context):
+    import textractactioncloud
+
+    metrics.reset()
+    textractactioncloud.existing_results.reset()
+    textractactioncloud.pdf_validations.reset()
+    saved = []
+    textractactioncloud.process_documents(textractactioncloud.bucket_name, textractactioncloud.subfolder,
+                                          on_saved=lambda document, result_key: saved.append(result_key))
+    write_reports(textractactioncloud)
+    return {'saved': len(saved)}
+
+# Run Textract on the PDFs of an S3 event: the page-1 fast path if enabled, otherwise an asynchronous job
+# whose completion goes to textract_completion_handler. Needs TEXTRACT_COMPLETION_MODE=notifications.
+# Validation results are not saved to the shared validation cache, concurrent invocations would overwrite it.
+def textract_document_handler(event, context):
+    import textractactioncloud as textract
+    from botocore.exceptions import ClientError
+
+    if textract.completion_mode != 'notifications':
+        raise ValueError("textract_document_handler needs TEXTRACT_COMPLETION_MODE=notifications")
+    metrics.reset()
+    textract.pdf_validations.reset()
+    counts = {'saved': 0, 'started': 0, 'skipped': 0}
+    for obj in s3_event_objects(event):
+        document = obj['Key']
+        if not document.lower().endswith(textract.SUPPORTED_EXTENSIONS):
+            counts['skipped'] += 1
+            continue
+        result_key = f"{textract.results_dir}/{os.path.basename(document).replace('.pdf', '.json')}"
+        try:
+            textract.s3_client.head_object(Bucket=obj['Bucket'], Key=result_key)
+            textract.logger.info("Skipping %s as result already exists.", document)
+            counts['skipped'] += 1
+            continue
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                raise
+        if document.lower().endswith('.pdf'):
+            with metrics.timer('textract', 'validate_pdf', document):
+                valid = textract.validate_pdf(obj['Bucket'], document, obj['ETag'])
+            if not valid:
+                textract.logger.warning("Skipping invalid PDF file: %s", document)
+                counts['skipped'] += 1
+                continue
+        if textract.page_one_fast_path:
+            with metrics.timer('textract', 'page_one', document):
+                if textract.detect_page_one(obj['Bucket'], document):
+                    counts['saved'] += 1
+                    continue
+        textract.call_with_retry(textract.start_textract, obj['Bucket'], document, obj['ETag'])
+        counts['started'] += 1
+    write_reports(textract)
+    return counts
+
+# Save the results of the Textract jobs reported finished by an event of the completion SNS topic
+def textract_completion_handler(event, context):
+    import textractactioncloud as textract
+    from utils.scheduler import read_completion_message
+
+    metrics.reset()
+    counts = {'saved': 0, 'failed': 0}
+    for body in sns_messages(event):
+        message = read_completion_message(body)
+        document = message['DocumentLocation']['S3ObjectName']
+        response = textract.call_with_retry(textract.textract_client.get_document_text_detection,
+                                            JobId=message['JobId'])
+        if textract.handle_result(document, message['JobId'], response):
+            counts['saved'] += 1
+        else:
+            counts['failed'] += 1
+    write_reports(textract)
+    return counts
+
+# Parse the Textract results of an S3 event and save every parsed waiver as JSON under waivers-parsed/,
+# with the ETag of the result it was parsed from
+def parse_document_handler(event, context):
+    import jsontoexcelcloud as excel
+    from utils.parallel import parse_waiver
+
+    metrics.reset()
+    parsed = 0
+    for obj in s3_event_objects(event):
+        if not (obj['Key'].startswith(excel.input_prefix) and obj['Key'].endswith('.json')):
+            continue
+        if obj['ETag'] is None:
+            obj['ETag'] = excel.s3.head_object(Bucket=excel.bucket_name, Key=obj['Key'])['ETag']
+        body, compact = excel.fetch_waiver_body(obj['Key'], obj['ETag'])
+        info, waived_regulations, timings = parse_waiver(body, compact, obj['Key'])
+        for operation, seconds in timings.items():
+            metrics.observe('excel', operation, seconds, obj['Key'])
+        record = {'ETag': obj['ETag'], 'info': info, 'waived': waived_regulations, 'parsed_at': time.time()}
+        excel.s3.put_object(Bucket=excel.bucket_name, Key=excel.parsed_key(obj['Key']),
+                            Body=json.dumps(record).encode('utf-8'), ContentType='application/json')
+        parsed += 1
+    write_reports(excel)
+    return {'parsed': parsed}
+
+# Add the new or changed waivers to the workbook, reusing the ones parse_document_handler parsed
+def excel_handler(event, context):
+    import jsontoexcelcloud as excel
+
+    metrics.reset()
+    processed_count = excel.update_workbook()
+    write_reports(excel)
+    return {'processed': processed_count}
@@ -1,13 +1,19 @@
+import io
 import json
+import multiprocessing
+import shutil
 import boto3
-from io import BytesIO
+from tempfile import SpooledTemporaryFile
 from dotenv import load_dotenv
 import os
-from openpyxl import load_workbook
-from dateutil import parser
-import re
-from utils.module import check_waiver_codes as obtain_code_entries
-from utils.module import convert_state_code_to_name as state_code_to_name
+from utils.locations import LocationsIndex
+from utils.metrics import instrument_client, metrics
+from utils.parallel import iter_parsed_waivers
+from utils.record_store import RecordStore
+from utils.s3_cache import S3ObjectCache
+from utils.s3_index import S3KeyIndex, iter_s3_objects
+from utils.textract_results import decode_source_etag, get_lines_key
+from utils.workbook import EditableSheet, is_external_link, save_rendered, save_streaming
 
 # Load environment variables from .env file
 load_dotenv()
@@ -22,156 +28,11 @@ s3 = boto3.client(
     aws_secret_access_key=aws_secret_access_key,
     region_name=aws_region
 )
+instrument_client(s3, 'excel')
 
-# Defining strings to be removed from objects
-string_remove = {
-    "location": "This certificate is issued for the operations specifically described hereinafter. No person shall conduct any operation pursuant to the"
-}
-
-# Used to create unformatted address
-def strip_and_merge(strings_list):
-    # Strip whitespace from each string in the list
-    stripped_strings = [s.strip() for s in strings_list]
-    # Merge the stripped strings with '/'
-    merged_string = '/'.join(stripped_strings)
-    return merged_string
-
-# Extract needed information
-def extract_final_info(blocks, key):
-    info = {
-        "Issued To": "",
-        "Responsible Person": "",
-        "Address": "",
-        "Street Name and Number": "",
-        "City": "",
-        "State": "",
-        "Zip Code": "",
-        "Waiver Number": "",
-        "Operations Authorized": "",
-        "List of Waived Regulations": "",
-        "Effective Date": "",
-        "Expire Date": "",
-        "Waiver URL": ""
-    }
-
-    capture_next = False
-    address_line_count = 0
-
-    info["Waiver URL"] = key.replace("json", "pdf").replace("waivers-pdf", "https://www.faa.gov/sites/faa.gov/files/")
-
-    for block in blocks:
-        if block['BlockType'] == 'LINE' and block['Page'] == 1:
-            text = block['Text']
-
-            if "ISSUED TO" in text:
-                capture_next = "Issued To"
-            elif "ADDRESS" in text:
-                capture_next = "Address"
-                address_line = [""] * 3
-                address_line_count = 0
-            elif "Responsible Person:" in text:
-                info["Responsible Person"] = text.split(":", 1)[1].strip()
-            elif "Responsible Party:" in text:
-                info["Responsible Person"] = text.split(":", 1)[1].strip()
-            elif "Waiver Number:" in text:
-                info["Waiver Number"] = text.split(":", 1)[1].strip()
-            elif "OPERATIONS AUTHORIZED" in text:
-                capture_next = "Operations Authorized"
-                info[capture_next] = ""  # Initialize as empty to append lines
-            elif "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE" in text:
-                capture_next = "List of Waived Regulations"
-                info[capture_next] = ""  # Initialize as empty to append lines
-            elif "effective from" in text.lower():
-                date_parts = text.split("effective from", 1)[1].split(" to ", 1)
-                if len(date_parts) == 2:
-                    start_date = parser.parse(date_parts[0].strip())
-                    end_date = parser.parse(date_parts[1].strip().split(",")[0].strip())
-                    info["Effective Date"] = start_date.strftime('%m/%d/%Y')
-                    info["Expire Date"] = end_date.strftime('%m/%d/%Y')
-
-            elif capture_next:
-                if capture_next == "Address":
-                    address_line[address_line_count] += (text + " ") if address_line_count < 3 else ""
-                    address_line_count += 1
-                    if address_line_count == 3:
-                        info[capture_next] = strip_and_merge(address_line)
-                        capture_next = False
-                        address_components = info["Address"]  # get_address(info["Address"])
-                        if address_components:
-                            if len(address_line[2]) > 40:  # Case when we have three-row address
-                                street_and_number, rest = address_components.split("/", 1)
-                                cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
-                                # Replace multiple spaces with a single space
-                                info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
-                                info["City"], rest = rest.split(",", 1)
-                                state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest)
-
-                                if state_zip:
-                                    info["State"] = state_code_to_name(state_zip.group(1))
-                                    info["Zip Code"] = state_zip.group(2)
-                                else:
-                                    state = zip_code = None
-                            else:
-                                street_and_number = address_line[0] + '/' + address_line[1]
-                                cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
-                                # Replace multiple spaces with a single space
-                                info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
-
-                                city_state_zip = address_line[2]
-                                info["City"], rest = city_state_zip.split(",", 1)
-                                state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest.strip())
-                                if state_zip:
-                                    info["State"] = state_code_to_name(state_zip.group(1))
-                                    info["Zip Code"] = state_zip.group(2)
-                                else:
-                                    info["State"] = None
-                                    info["Zip Code"] = None
-                        else:
-                            # Handle the case where address_components is None
-                            info["Street Name and Number"] = "Unknown"
-                            info["City"] = "Unknown"
-                            info["State"] = "Unknown"
-                            info["Zip Code"] = "Unknown"
-
-                elif capture_next == "List of Waived Regulations":
-                    # Append each new line to the List of Waived Regulations
-                    info[capture_next] += text + " "
-                    # Continue capturing until a new section starts
-                    if any (keyword in text for keyword in ["STANDARD PROVISIONS"]):
-                        capture_next = False
-                elif capture_next == "Operations Authorized":
-                    # Append each new line to the List of Waived Regulations
-                    info[capture_next] += text + " "
-                    # Continue capturing until a new section starts
-                    if any (keyword in text for keyword in ["LIST OF WAIVED REGULATIONS BY SECTION AND TITLE"]):
-                        capture_next = False
-                else:
-                    info[capture_next] = text
-                    capture_next = False
-
-    for key in info.keys():
-        info[key] = info[key].strip()
-
-    # Remove 'STANDARD PROVISIONS' from the final output if it was appended
-    if "STANDARD PROVISIONS" in info["List of Waived Regulations"]:
-        info["List of Waived Regulations"] = info["List of Waived Regulations"].replace("STANDARD PROVISIONS",
-                                                                                        "").strip()
-
-    # Remove 'LIST OF WAIVED REGULATIONS BY SECTION AND TITLE' from the final output if it was appended
-    if "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE" in info["Operations Authorized"]:
-        info["Operations Authorized"] = info["Operations Authorized"].replace(
-            "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE", "").strip()
-
-    # Remove redundant string from ["Address"]
-    if string_remove["location"] in info["Address"]:
-        info["Address"] = info["Address"].replace(
-            string_remove["location"], "").strip()
-
-    return info
-
-# Find the first empty row in a sheet
-def find_first_empty_row(sheet):
-    for row in range(2, sheet.max_row + 2):
+# Find the first empty row in a sheet, starting the search at start_row
+def find_first_empty_row(sheet, start_row=2):
+    for row in range(start_row, sheet.max_row + 2):
         if not sheet.cell(row=row, column=1).value:
             return row
     return sheet.max_row + 1
@@ -182,43 +43,174 @@ def remove_external_links(workbook):
         ws = workbook[sheet]
         for row in ws.iter_rows():
             for cell in row:
-                if cell.data_type == 'f' and cell.value and cell.value.startswith('['):
+                if is_external_link(cell):
                     cell.value = None
 
-# Find the next available Company ID
-def get_next_company_id(locations_sheet):
-    company_ids = [int(row[1][1:]) for row in locations_sheet.iter_rows(min_row=2, values_only=True) if row and row[1] and row[1].startswith('C')]
-    return f"C{(max(company_ids) + 1) if company_ids else 1}"
-
-# Find the next available Operator ID
-def get_next_operator_id(locations_sheet):
-    operator_ids = [row[0] for row in locations_sheet.iter_rows(min_row=2, values_only=True) if row and row[0] is not None]
-    return (max(operator_ids) + 1) if operator_ids else 1
+# Read the body of a waiver, preferring the compact LINE object over the raw Textract JSON.
+# The LINE object is only used when it was derived from this version of the JSON: one left behind by a failed
+# write, or by an earlier result of a reprocessed document, is ignored.
+# Pass the ETag of the JSON when it is known, e.g. from the listing, so it is not read from S3 and a cached
+# copy of the JSON is read without a request.
+# Returns the body and whether it is the compact LINE object.
+def fetch_waiver_body(json_key, etag=None):
+    with metrics.timer('excel', 's3_get', json_key):
+        if etag is None:
+            etag = s3.head_object(Bucket=bucket_name, Key=json_key)['ETag']
+        try:
+            body = s3_cache.read(bucket_name, get_lines_key(json_key))
+            if decode_source_etag(body) == etag:
+                return body, True
+            metrics.count('excel', 'lines_stale')
+        except s3.exceptions.NoSuchKey:
+            pass
+        return s3_cache.read(bucket_name, json_key, etag), False
+
+# Key of the parsed waiver saved by the per-document handler for a JSON key
+def parsed_key(json_key):
+    return parsed_prefix + json_key[len(input_prefix):]
+
+# Parsed waiver of a JSON object saved by the per-document handler, as (info, waived_regulations),
+# or None if there is none for this version of the JSON and it has to be fetched and parsed here
+def fetch_parsed_waiver(obj):
+    key = parsed_key(obj['Key'])
+    if key not in parsed_waivers:
+        return None
+    with metrics.timer('excel', 's3_get', key):
+        try:
+            record = json.loads(s3_cache.read(bucket_name, key))
+        except s3.exceptions.NoSuchKey:
+            return None
+    if record.get('ETag') != obj['ETag']:
+        return None
+    metrics.count('excel', 'parsed_reused')
+    return record['info'], record['waived']
+
+# Load the processed-waiver ledger: JSON key -> ETag and Waiver Number of the last processed version
+def load_ledger():
+    try:
+        return json.loads(s3_cache.read(bucket_name, ledger_file_key))
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+# Save the processed-waiver ledger back to S3, and to the cache so the next run does not download it again
+def save_ledger(ledger):
+    body = json.dumps(ledger).encode('utf-8')
+    response = s3.put_object(Bucket=bucket_name, Key=ledger_file_key, Body=body, ContentType='application/json')
+    s3_cache.put(bucket_name, ledger_file_key, response['ETag'], io.BytesIO(body))
+
+# Open the record store: a copy of the one in S3, or a new one imported from the workbook on the first run
+def load_record_store(workbook):
+    # The copy in S3 is the source of truth, drop what a crashed run left behind
+    for path in (record_store_path, f"{record_store_path}-journal"):
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        with s3_cache.open(bucket_name, record_store_key) as stored, open(record_store_path, 'wb') as f:
+            shutil.copyfileobj(stored, f)
+    except s3.exceptions.NoSuchKey:
+        pass
+    store = RecordStore(record_store_path)
+    if store.is_empty():
+        store.import_workbook(workbook)
+    return store
+
+# Commit the record store and upload it back to S3
+def save_record_store(store):
+    store.commit()
+    store.close()
+    with open(record_store_path, 'rb') as f:
+        s3_cache.upload(f, bucket_name, record_store_key)
+
+# Map every Waiver Number already in the Waiver Data sheet to its row
+def get_waiver_rows(waiver_data_sheet):
+    waiver_rows = {}
+    for row, (waiver_number,) in enumerate(waiver_data_sheet.iter_rows(min_row=2, min_col=6, max_col=6, values_only=True), start=2):
+        if waiver_number:
+            waiver_rows[waiver_number] = row
+    return waiver_rows
 
 # S3 storage values
 bucket_name = 'auvsi-uav-waivers'
 input_prefix = 'waivers-json/'
 output_file_key = 'waivers_info.xlsx'
-
-# Read the existing Excel file from S3
-response = s3.get_object(Bucket=bucket_name, Key=output_file_key)
-existing_file = response['Body'].read()
-
-wb = load_workbook(filename=BytesIO(existing_file))
-remove_external_links(wb)
-waiver_data_sheet = wb["Waiver Data"]
-locations_sheet = wb["Locations"]
-
-# List objects in the specified S3 bucket and prefix
-response = s3.list_objects_v2(Bucket=bucket_name, Prefix=input_prefix)
-
-# Iterate through the files in the bucket
-for obj in response.get('Contents', []):
-    if obj['Key'].endswith('.json'):
-        # Read the JSON file from S3
-        json_file = s3.get_object(Bucket=bucket_name, Key=obj['Key'])
-        textract_response = json.loads(json_file['Body'].read())
-        final_extracted_info = extract_final_info(textract_response['Blocks'], obj['Key'])
+ledger_file_key = 'waivers-ledger.json'
+# Waivers parsed by the per-document handler (see handlers.py), one JSON object per JSON key of input_prefix
+parsed_prefix = 'waivers-parsed/'
+# SQLite store of the parsed waivers and the rows of the Waiver Data and Locations sheets, see EXCEL_OUTPUT_MODE
+record_store_key = 'waivers-records.db'
+record_store_path = os.getenv('EXCEL_RECORD_STORE', 'waivers-records.db')
+
+# Parallelism of the fetch and parse stage, the workbook itself is always written by one thread
+fetch_workers = int(os.getenv('EXCEL_FETCH_WORKERS', '8'))
+parse_workers = int(os.getenv('EXCEL_PARSE_WORKERS', str(os.cpu_count() or 1)))
+max_pending = int(os.getenv('EXCEL_MAX_PENDING', '32'))
+
+# Size of the local cache of S3 objects in MB, shared by the scripts across runs; 0 reads everything from S3
+s3_cache_size = int(os.getenv('S3_CACHE_SIZE_MB', '256')) * 1024 * 1024
+s3_cache = S3ObjectCache(s3, 'excel', s3_cache_size)
+# Keys of the parsed waivers, listed once per run on first use
+parsed_waivers = S3KeyIndex(s3, bucket_name, parsed_prefix)
+# Workbook output mode: 'workbook' loads and saves the full workbook with openpyxl,
+# 'streaming' reads it read-only and writes a values-only copy through a write-only workbook,
+# 'store' keeps the waivers and sheet rows in the record store and renders both sheets from it in a values-only copy
+output_mode = os.getenv('EXCEL_OUTPUT_MODE', 'workbook')
+# Workbooks up to this size stay in memory, larger ones are spooled to a temporary file
+spool_size = 64 * 1024 * 1024
+# Run report (.json or .csv) and Prometheus text file written at the end of a run, if set
+metrics_report = os.getenv('METRICS_REPORT')
+metrics_prometheus = os.getenv('METRICS_PROMETHEUS')
+
+# The workbook being updated by a run: its Waiver Data and Locations sheets, their indexes and the ledger
+class WaiverWorkbook:
+    def __init__(self):
+        # openpyxl is only needed by the workbook, not by the fetch and parse helpers of this module
+        from openpyxl import load_workbook
+
+        # Read the existing Excel file from S3, or from the cache if it has not changed
+        with metrics.timer('excel', 'workbook_download'):
+            existing_file = s3_cache.open(bucket_name, output_file_key, spool_size=spool_size)
+
+        with metrics.timer('excel', 'workbook_load'):
+            self.store = None
+            if output_mode == 'store':
+                # Only the other sheets and the headers are copied from the workbook, in save_rendered
+                self.wb = load_workbook(filename=existing_file, read_only=True)
+                with metrics.timer('excel', 'store_load'):
+                    self.store = load_record_store(self.wb)
+                self.waiver_data_sheet = self.store.sheet("Waiver Data")
+                self.locations_sheet = self.store.sheet("Locations")
+            elif output_mode == 'streaming':
+                # External links are stripped while the workbook is copied in save_streaming
+                self.wb = load_workbook(filename=existing_file, read_only=True)
+                self.waiver_data_sheet = EditableSheet(self.wb["Waiver Data"])
+                self.locations_sheet = EditableSheet(self.wb["Locations"])
+            else:
+                self.wb = load_workbook(filename=existing_file)
+                remove_external_links(self.wb)
+                self.waiver_data_sheet = self.wb["Waiver Data"]
+                self.locations_sheet = self.wb["Locations"]
+        with metrics.timer('excel', 'index_build'):
+            self.locations_index = LocationsIndex(self.locations_sheet)
+            self.waiver_rows = self.store.waiver_rows() if self.store else get_waiver_rows(self.waiver_data_sheet)
+        self.next_waiver_row = find_first_empty_row(self.waiver_data_sheet)
+        self.ledger = load_ledger()
+        self.processed_count = 0
+
+    # Check if a JSON object changed since it was last processed
+    def is_new(self, obj):
+        return self.ledger.get(obj['Key'], {}).get('ETag') != obj['ETag']
+
+    # Add or update the rows of one parsed waiver, returns False if it was only recorded in the ledger
+    def add(self, obj, final_extracted_info, waived_regulations):
+        ledger_entry = self.ledger.get(obj['Key'])
+        waiver_number = final_extracted_info["Waiver Number"]
+
+        # Waiver added to the workbook before the ledger existed, only record it
+        if not ledger_entry and waiver_number in self.waiver_rows:
+            self.ledger[obj['Key']] = {"ETag": obj['ETag'], "Waiver Number": waiver_number}
+            if self.store:
+                self.store.put_record(obj, final_extracted_info, waived_regulations)
+            return False
 
         responsible_person = final_extracted_info["Responsible Person"].strip()
         address_street = final_extracted_info["Street Name and Number"].strip()
@@ -231,42 +223,25 @@ for obj in response.get('Contents', []):
         company_id = None
         full_operator_id = None
 
-        # Find all rows with matching Responsible Person
-        matching_rows = []
-        for row in locations_sheet.iter_rows(min_row=2, values_only=True):
-            if row and len(row) > 3 and row[3] and row[3].strip() == responsible_person:
-                matching_rows.append(row)
-
-        # Check each matching row for address match
-        address_match_found = False
-        for row in matching_rows:
-            if row[4].strip() == address_street:  # Assuming address is in the 5th column (index 4)
-                address_match_found = True
-                if row[11] and row[11].strip().replace(".", "").replace(",", "") == final_extracted_info["Issued To"].strip().replace(".", "").replace(",", ""):
-                    break
-                else:
-                    # Different company, new Company ID needed
-                    if responsible_person == final_extracted_info["Issued To"]:
-                        company_id = "INDIVIDUAL"
-                    else:
-                        company_id = get_next_company_id(locations_sheet)
-                    full_operator_id = f"{row[0]}-{company_id}"
-                    break
+        # Find all rows with matching Responsible Person and check them for an address match
+        with metrics.timer('excel', 'locations_lookup', obj['Key']):
+            matching_rows = self.locations_index.find_rows(responsible_person)
+            address_match_found = self.locations_index.find_address(responsible_person, address_street) is not None
 
         if not matching_rows:
             # No matching Responsible Person found, assign new Operator ID and Company ID
-            operator_id = get_next_operator_id(locations_sheet)
+            operator_id = self.locations_index.next_operator_id()
             if responsible_person == final_extracted_info["Issued To"]:
                 company_id = "INDIVIDUAL"
             else:
-                company_id = get_next_company_id(locations_sheet)
+                company_id = self.locations_index.next_company_id()
             full_operator_id = f"{operator_id}-{company_id}"
 
         elif not address_match_found:
             # Matching Responsible Person found but no matching address
             operator_id = matching_rows[0][0]  # Use the operator ID from the first match
             if responsible_person != final_extracted_info["Issued To"]:
-                company_id = get_next_company_id(locations_sheet)
+                company_id = self.locations_index.next_company_id()
             else:
                 company_id = "INDIVIDUAL"
             full_operator_id = f"{operator_id}-{company_id}"
@@ -274,7 +249,7 @@ for obj in response.get('Contents', []):
         elif address_match_found:
             operator_id = matching_rows[0][0]  # Use the operator ID from the first match
             if responsible_person != final_extracted_info["Issued To"]:
-                company_id = get_next_company_id(locations_sheet)
+                company_id = self.locations_index.next_company_id()
             else:
                 company_id = "INDIVIDUAL"
             full_operator_id = f"{operator_id}-{company_id}"
@@ -286,15 +261,12 @@ for obj in response.get('Contents', []):
                 address_street, address_city, address_state, address_zip,
                 "", "", "", "" if company_id == "INDIVIDUAL" else final_extracted_info["Issued To"]
             ]
-            first_empty_row = find_first_empty_row(locations_sheet)
-            for col, value in enumerate(new_location, start=1):
-                locations_sheet.cell(row=first_empty_row, column=col, value=value)
+            self.locations_index.append(new_location)
 
         # Add entry to Waiver Data sheet
         effective_date = final_extracted_info["Effective Date"]
         expire_date = final_extracted_info["Expire Date"]
         waiver_url = final_extracted_info["Waiver URL"]
-        waived_regulations = obtain_code_entries(final_extracted_info["List of Waived Regulations"])
 
         new_waiver_data = [
             operator_id, company_id, full_operator_id, effective_date,
@@ -312,16 +284,77 @@ for obj in response.get('Contents', []):
             waived_regulations["Over Moving Vehicles"],
             final_extracted_info["Operations Authorized"]
         ]
-        first_empty_row = find_first_empty_row(waiver_data_sheet)
+        # Changed waivers overwrite their existing row, new ones are appended
+        waiver_row = self.waiver_rows.get(waiver_number) or self.next_waiver_row
         for col, value in enumerate(new_waiver_data, start=1):
-            waiver_data_sheet.cell(row=first_empty_row, column=col, value=value)
-
-# Save the updated Excel file to a BytesIO object
-output = BytesIO()
-wb.save(output)
-output.seek(0)
-
-# Upload the updated file back to S3
-s3.put_object(Bucket=bucket_name, Key=output_file_key, Body=output)
-
-print(f"Data successfully appended to {output_file_key}")
+            self.waiver_data_sheet.cell(row=waiver_row, column=col, value=value)
+        self.next_waiver_row = find_first_empty_row(self.waiver_data_sheet, self.next_waiver_row)
+        if waiver_number:
+            self.waiver_rows[waiver_number] = waiver_row
+        self.ledger[obj['Key']] = {"ETag": obj['ETag'], "Waiver Number": waiver_number}
+        if self.store:
+            self.store.put_record(obj, final_extracted_info, waived_regulations)
+        self.processed_count += 1
+        return True
+
+
+    # Save the workbook and upload it to S3, then record the processed waivers
+    def save(self):
+        # Save the updated Excel file to a spooled buffer
+        output = SpooledTemporaryFile(max_size=spool_size)
+        with metrics.timer('excel', 'workbook_save'):
+            if output_mode == 'store':
+                save_rendered(self.wb, [self.waiver_data_sheet, self.locations_sheet], output)
+                self.wb.close()
+            elif output_mode == 'streaming':
+                save_streaming(self.wb, [self.waiver_data_sheet, self.locations_sheet], output)
+                self.wb.close()
+            else:
+                self.wb.save(output)
+        output.seek(0)
+
+        # The store goes first: a workbook is always rendered from a saved store
+        if self.store:
+            with metrics.timer('excel', 'store_upload'):
+                save_record_store(self.store)
+
+        # Upload the updated file back to S3 (multipart for large workbooks) and keep it in the local cache,
+        # then record the processed waivers
+        with metrics.timer('excel', 'workbook_upload'):
+            s3_cache.upload(output, bucket_name, output_file_key)
+        save_ledger(self.ledger)
+
+# List the JSON objects of the waivers, lazily and one listing page at a time
+def list_waiver_objects():
+    return iter_s3_objects(s3, bucket_name, input_prefix, suffixes=('.json',))
+
+# Add the new or changed waivers to the workbook and save it. Returns the number of waivers added or updated.
+# - objects: iterable of JSON objects ({'Key', 'ETag', ...}), the listing of input_prefix by default. Objects
+#   which changed since they were last processed are parsed in parallel and added in order, each key once.
+# - pool_args: overrides of the iter_parsed_waivers arguments, e.g. mp_context
+def update_workbook(objects=None, **pool_args):
+    waiver_workbook = WaiverWorkbook()
+    parsed_waivers.reset()
+    seen = set()
+
+    def new_objects():
+        for obj in list_waiver_objects() if objects is None else objects:
+            if obj['Key'] not in seen and waiver_workbook.is_new(obj):
+                seen.add(obj['Key'])
+                yield obj
+
+    # The parse processes are started by the first submit, from a fetch thread while the others run, so they are
+    # spawned: a forked child could inherit a lock held by another thread
+    pool_args = dict({'fetch_workers': fetch_workers, 'parse_workers': parse_workers, 'max_pending': max_pending,
+                      'fetch_parsed': fetch_parsed_waiver, 'mp_context': multiprocessing.get_context('spawn')},
+                     **pool_args)
+    for obj, final_extracted_info, waived_regulations in iter_parsed_waivers(new_objects(), fetch_waiver_body,
+                                                                             **pool_args):
+        waiver_workbook.add(obj, final_extracted_info, waived_regulations)
+    waiver_workbook.save()
+    return waiver_workbook.processed_count
+
+if __name__ == '__main__':
+    processed_count = update_workbook()
+    print(f"Data for {processed_count} new or changed waivers successfully appended to {output_file_key}")
+    metrics.write_reports(metrics_report, metrics_prometheus)
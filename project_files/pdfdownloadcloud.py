@@ -1,15 +1,23 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
 import boto3
+import io
+import json
 import os
+from boto3.s3.transfer import TransferConfig
 from dotenv import load_dotenv
+from utils.crawler import Crawler, HashingReader, conditional_headers, create_session, parse_pdf_links
+from utils.metrics import instrument_client, metrics
+from utils.s3_cache import S3ObjectCache
+from utils.s3_index import S3KeyIndex
 
-# URL of the page containing PDF links
-url = "https://www.faa.gov/uas/commercial_operators/part_107_waivers/waivers_issued?page=3"
+# URL of the pages containing PDF links, crawled as ?page=0, 1, ... until a page has no new links
+url = "https://www.faa.gov/uas/commercial_operators/part_107_waivers/waivers_issued"
 
 # AWS S3 bucket name and subfolder
 bucket_name = "auvsi-uav-waivers"
 subfolder = "waivers-raw-pdf"  # specify the subfolder in your S3 bucket
+# ETag, Last-Modified and SHA-256 of every downloaded PDF, used for conditional requests
+manifest_file_key = "waivers-pdf-manifest.json"
 
 # Load environment variables from .env file
 load_dotenv()
@@ -17,6 +25,24 @@ aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
 aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 aws_region = os.getenv('AWS_REGION')
 
+# Crawler settings
+per_host_limit = int(os.getenv('CRAWLER_PER_HOST_LIMIT', '8'))
+download_workers = int(os.getenv('CRAWLER_DOWNLOAD_WORKERS', '16'))
+max_pages = int(os.getenv('CRAWLER_MAX_PAGES')) if os.getenv('CRAWLER_MAX_PAGES') else None
+# Seconds a local copy of the S3 key listing may be reused, 0 lists the bucket on every run
+index_cache_ttl = int(os.getenv('S3_INDEX_CACHE_TTL', '0'))
+# Size of the local cache of S3 objects in MB, shared by the scripts across runs; 0 reads everything from S3
+s3_cache_size = int(os.getenv('S3_CACHE_SIZE_MB', '256')) * 1024 * 1024
+# Revalidate PDFs already in S3 with conditional requests instead of skipping them, to pick up files FAA changed
+refresh_existing = os.getenv('CRAWLER_REFRESH_EXISTING', 'false').lower() in ('1', 'true', 'yes')
+# Run report (.json or .csv) and Prometheus text file written at the end of a run, if set
+metrics_report = os.getenv('METRICS_REPORT')
+metrics_prometheus = os.getenv('METRICS_PROMETHEUS')
+
+# Uploads are streamed in 8 MB parts, so memory per download stays constant whatever the PDF size
+transfer_config = TransferConfig(multipart_threshold=8 * 1024 * 1024, multipart_chunksize=8 * 1024 * 1024,
+                                 max_concurrency=2)
+
 # Initialize boto3 S3 client with credentials
 s3 = boto3.client(
     's3',
@@ -24,36 +50,126 @@ s3 = boto3.client(
     aws_secret_access_key=aws_secret_access_key,
     region_name=aws_region
 )
+instrument_client(s3, 'download')
+s3_cache = S3ObjectCache(s3, 'download', s3_cache_size)
 
-# Download pdf file to subfolder if it doesn't exist there already
-def download_pdf_to_s3(pdf_url, bucket_name, s3_key):
-    # Check if the file already exists in S3
+# HTTP session with a connection pool, shared by all requests
+session = create_session(pool_size=max(per_host_limit, download_workers))
+
+# PDF files already in the S3 subfolder, listed once on first use
+existing_pdfs = S3KeyIndex(s3, bucket_name, f"{subfolder}/", ttl=index_cache_ttl)
+# s3 key -> {'ETag', 'Last-Modified', 'SHA256', 'URL'} of the FAA response it was downloaded from, loaded from S3
+# per run
+manifest = {}
+
+# Load the manifest of downloaded PDFs from S3, empty on the first run
+def load_manifest():
     try:
-        s3.head_object(Bucket=bucket_name, Key=s3_key)
+        return json.loads(s3_cache.read(bucket_name, manifest_file_key))
+    except s3.exceptions.NoSuchKey:
+        return {}
+
+# Save the manifest of downloaded PDFs back to S3, and to the cache so the next run does not download it again
+def save_manifest():
+    body = json.dumps(manifest).encode('utf-8')
+    response = s3.put_object(Bucket=bucket_name, Key=manifest_file_key, Body=body, ContentType='application/json')
+    s3_cache.put(bucket_name, manifest_file_key, response['ETag'], io.BytesIO(body))
+
+# Check if a PDF has to be requested: new files always, files already in S3 only when refreshing
+def needs_download(s3_key):
+    if s3_key in existing_pdfs and not refresh_existing:
         print(f"File {s3_key} already exists in S3. Skipping...")
-    except Exception as e:
-        # File does not exist, download and upload
-        response = requests.get(pdf_url)
-        s3.put_object(Bucket=bucket_name, Key=s3_key, Body=response.content)
-        print(f"Downloaded {pdf_url} to s3://{bucket_name}/{s3_key}")
+        return False
+    return True
+
+# Stream a response body to S3 in chunks, hashing it on the way, and record it in the manifest.
+# The source of the PDF is attached to the object as metadata with the upload. The hash is only known once the
+# body is read, so it is kept in the manifest only: attaching it to the object would take a copy of the object
+# onto itself, a second write which fires another ObjectCreated event and replaces the ETag the Textract stage
+# keys its caches and job tokens on.
+def upload_pdf_stream(response, s3_key):
+    response.raw.decode_content = True
+    body = HashingReader(response.raw)
+    metadata = {'source-url': response.url}
+    if response.headers.get('ETag'):
+        metadata['source-etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        metadata['source-last-modified'] = response.headers['Last-Modified']
+    # Reading the body and uploading it overlap, so they are timed together
+    with metrics.timer('download', 'transfer', s3_key):
+        s3.upload_fileobj(body, bucket_name, s3_key, ExtraArgs={'ContentType': 'application/pdf', 'Metadata': metadata},
+                          Config=transfer_config)
+    metrics.add_bytes('download', 'http_in', body.size)
+    manifest[s3_key] = {'ETag': response.headers.get('ETag'), 'Last-Modified': response.headers.get('Last-Modified'),
+                        'SHA256': body.hexdigest(), 'URL': response.url}
+    return body.size
+
+# Download pdf file to subfolder if it doesn't exist there already
+def download_pdf_to_s3(pdf_url, bucket_name, s3_key):
+    if not needs_download(s3_key):
+        return
+    # Ask FAA for the file only if it changed since the last download
+    metrics.count_call('http', 'GET')
+    with metrics.timer('download', 'http_fetch', s3_key):
+        response = session.get(pdf_url, stream=True, headers=conditional_headers(manifest.get(s3_key)))
+    with response:
+        if response.status_code == 304:
+            print(f"File {s3_key} has not changed. Skipping...")
+            return
+        response.raise_for_status()
+        size = upload_pdf_stream(response, s3_key)
+    existing_pdfs.add(s3_key)
+    print(f"Downloaded {pdf_url} ({size} bytes) to s3://{bucket_name}/{s3_key}")
+
+# Async version of download_pdf_to_s3 used by the crawler, returns the S3 key of a downloaded file
+async def download_pdf_to_s3_async(crawler, pdf_url):
+    s3_key = f"{subfolder}/{os.path.basename(pdf_url)}"
+    if not needs_download(s3_key):
+        return None
+    # The body is streamed by the upload, so the host slot is held until the transfer is over
+    async with crawler.host_slot(pdf_url):
+        with metrics.timer('download', 'http_fetch', s3_key):
+            response = await crawler.fetch(pdf_url, in_slot=True, stream=True,
+                                           headers=conditional_headers(manifest.get(s3_key)))
+        try:
+            if response.status_code == 304:
+                print(f"File {s3_key} has not changed. Skipping...")
+                return None
+            size = await asyncio.to_thread(upload_pdf_stream, response, s3_key)
+        finally:
+            response.close()
+    existing_pdfs.add(s3_key)
+    print(f"Downloaded {pdf_url} ({size} bytes) to s3://{bucket_name}/{s3_key}")
+    return s3_key
 
 # Get pdf links from the actual Web page
 def get_pdf_links(page_url):
-    response = requests.get(page_url)
-    soup = BeautifulSoup(response.content, 'html.parser')
-    pdf_links = []
-    for link in soup.find_all('a', href=True):
-        href = link['href']
-        if href.lower().endswith('.pdf'):
-            pdf_links.append(href)
-    return pdf_links
-
-pdf_links = get_pdf_links(url)
-
-for pdf_link in pdf_links:
-    pdf_url = pdf_link
-    if not pdf_url.startswith('http'):
-        pdf_url = f"https://www.faa.gov{pdf_url}"
-    pdf_name = os.path.basename(pdf_url)
-    s3_key = f"{subfolder}/{pdf_name}"
-    download_pdf_to_s3(pdf_url, bucket_name, s3_key)
\ No newline at end of file
+    response = session.get(page_url)
+    return parse_pdf_links(response.content, page_url)
+
+# Crawl every waivers_issued page and download all new pdf files with download(crawler, url), a coroutine
+# returning the S3 key of a downloaded file or None. Returns the S3 keys of the downloaded files.
+async def sync_all_pdfs(download=download_pdf_to_s3_async):
+    crawler = Crawler(session, per_host_limit=per_host_limit)
+    await asyncio.to_thread(existing_pdfs.load)
+    manifest.update(await asyncio.to_thread(load_manifest))
+    downloaded = []
+
+    async def download_and_record(crawler, pdf_url):
+        s3_key = await download(crawler, pdf_url)
+        if s3_key:
+            downloaded.append(s3_key)
+
+    try:
+        failed = await crawler.crawl(url, download_and_record, download_workers=download_workers,
+                                     max_pages=max_pages)
+    finally:
+        existing_pdfs.save()
+        save_manifest()
+    if failed:
+        print(f"{len(failed)} PDF files failed to download.")
+    return downloaded
+
+if __name__ == '__main__':
+    asyncio.run(sync_all_pdfs())
+    metrics.write_reports(metrics_report, metrics_prometheus)
@@ -0,0 +1,136 @@
+# Run the whole waiver pipeline in one process: download -> Textract -> Excel.
+# The three stages run at the same time, connected by bounded queues: a PDF goes to Textract as soon as it is
+# in S3, and its parsed waiver reaches the workbook as soon as its JSON is saved. Each stage also picks up the
+# work left in S3 by earlier runs, like the stage scripts do.
+# Run from the repository root: python -m project_files.pipeline
+import asyncio
+import itertools
+import os
+import queue
+import sys
+import threading
+
+# The stage modules import their helpers as the top-level utils package, like when they run as scripts
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import jsontoexcelcloud
+import pdfdownloadcloud
+import textractactioncloud
+from utils.metrics import metrics
+
+# Maximum number of documents waiting between two stages
+queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '100'))
+# Run report (.json or .csv) and Prometheus text file written at the end of a run, if set
+metrics_report = os.getenv('METRICS_REPORT')
+metrics_prometheus = os.getenv('METRICS_PROMETHEUS')
+
+# Bounded queue between two stages. The producer calls close() after its last item.
+class StageQueue(queue.Queue):
+    DONE = object()
+
+    def __init__(self, maxsize):
+        super().__init__(maxsize)
+        self.drained = False
+
+    def close(self):
+        self.put(self.DONE)
+
+    # Yield the items until the queue is closed, blocking while none is ready
+    def __iter__(self):
+        while not self.drained:
+            item = self.get()
+            if item is self.DONE:
+                self.drained = True
+                return
+            yield item
+
+    # Like __iter__, but yield None whenever no item is ready, so the Textract scheduler
+    # keeps polling its running jobs while it waits for downloads
+    def iter_ready(self):
+        while not self.drained:
+            try:
+                item = self.get_nowait()
+            except queue.Empty:
+                yield None
+                continue
+            if item is self.DONE:
+                self.drained = True
+                return
+            yield item
+
+    # Consume the rest of the queue, so its producer is not blocked forever after the consumer failed
+    def discard(self):
+        for _ in self:
+            pass
+
+# Stage 1: crawl the FAA pages and put the S3 key of every downloaded PDF on downloaded
+def download_stage(downloaded):
+    async def download(crawler, pdf_url):
+        s3_key = await pdfdownloadcloud.download_pdf_to_s3_async(crawler, pdf_url)
+        if s3_key:
+            await asyncio.to_thread(downloaded.put, {'Key': s3_key})
+        return s3_key
+
+    try:
+        asyncio.run(pdfdownloadcloud.sync_all_pdfs(download))
+    finally:
+        downloaded.close()
+
+# Stage 2: run Textract on the PDFs in S3 and the downloaded ones, and put every saved result on results
+def textract_stage(downloaded, results):
+    def on_saved(document, result_key):
+        etag = textractactioncloud.s3_client.head_object(Bucket=textractactioncloud.bucket_name, Key=result_key)['ETag']
+        results.put({'Key': result_key, 'ETag': etag})
+
+    try:
+        textractactioncloud.process_documents(textractactioncloud.bucket_name, textractactioncloud.subfolder,
+                                              new_documents=downloaded.iter_ready(), on_saved=on_saved)
+    finally:
+        results.close()
+        downloaded.discard()
+
+# Stage 3: parse the new or changed results in S3 and the saved ones, and update the workbook.
+# A result saved while the listing runs can come from both, update_workbook processes it once.
+# Returns the number of waivers added or updated.
+def excel_stage(results):
+    try:
+        return jsontoexcelcloud.update_workbook(itertools.chain(jsontoexcelcloud.list_waiver_objects(), results))
+    finally:
+        results.discard()
+
+# Thread running one stage, keeping the exception the stage failed with
+class StageThread(threading.Thread):
+    def __init__(self, target, args, name):
+        super().__init__(target=target, args=args, name=name)
+        self.error = None
+
+    def run(self):
+        try:
+            super().run()
+        except BaseException as e:
+            self.error = e
+
+# Run the three stages. The download and Textract stages run in threads; once all stages are over, the first
+# exception one of them failed with is raised again, so a failed stage fails the run.
+def run_pipeline():
+    downloaded = StageQueue(queue_size)
+    results = StageQueue(queue_size)
+    stages = [
+        StageThread(target=download_stage, args=(downloaded,), name='download'),
+        StageThread(target=textract_stage, args=(downloaded, results), name='textract'),
+    ]
+    for stage in stages:
+        stage.start()
+    try:
+        processed_count = excel_stage(results)
+    finally:
+        for stage in stages:
+            stage.join()
+    for stage in stages:
+        if stage.error is not None:
+            raise stage.error
+    print(f"Data for {processed_count} new or changed waivers successfully appended to {jsontoexcelcloud.output_file_key}")
+    metrics.write_reports(metrics_report, metrics_prometheus)
+
+if __name__ == '__main__':
+    run_pipeline()
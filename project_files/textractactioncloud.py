@@ -1,11 +1,19 @@
 import boto3
 import time
-import json
+import io
+import itertools
 import logging
 import os
-from PyPDF2 import PdfReader
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError, PartialCredentialsError
 from dotenv import load_dotenv
+from utils.job_store import SAVED, JobStore, job_token, resumable_jobs
+from utils.metrics import instrument_client, metrics
+from utils.module import find_missing_fields
+from utils.pdf_validation import ValidationCache, count_pages, count_pages_from_ends, extract_first_page, read_object_ends
+from utils.s3_cache import S3ObjectCache
+from utils.s3_index import S3KeyIndex, iter_s3_objects
+from utils.scheduler import FINISHED_STATUSES, call_with_retry, run_textract_jobs, run_textract_jobs_notified
+from utils.textract_results import IterStream, collect_lines, encode_lines, get_lines_key, iter_result_json, iter_result_pages
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -15,13 +23,36 @@ subfolder = 'waivers-raw-pdf'
 
 # S3 bucket to save Textract results
 results_dir = 'waivers-json'
-os.makedirs(results_dir, exist_ok=True)
 
 # Load environment variables from .env file
 load_dotenv()
 aws_access_key_id = os.getenv('AWS_ACCESS_KEY_ID')
 aws_secret_access_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 aws_region = os.getenv('AWS_REGION')
+# Maximum number of Textract jobs running at the same time
+max_in_flight = int(os.getenv('TEXTRACT_MAX_IN_FLIGHT', '10'))
+# Seconds a local copy of the S3 key listing may be reused, 0 lists the bucket on every run
+index_cache_ttl = int(os.getenv('S3_INDEX_CACHE_TTL', '0'))
+# PDF validation: 'ranged' reads only the head and tail of a PDF when they are conclusive, 'full' always reads all of it
+validation_mode = os.getenv('PDF_VALIDATION_MODE', 'ranged')
+# Validation results by ETag, so the same file is never validated twice
+validation_cache_key = 'waivers-pdf-validation.json'
+# Local SQLite ledger of started Textract jobs, so an interrupted run re-attaches to them instead of starting them again
+job_store_path = os.getenv('TEXTRACT_JOB_STORE', 'textract-jobs.db')
+# How finished Textract jobs are found: 'polling' polls every running job, 'notifications' passes an SNS topic
+# as NotificationChannel and waits for the completions on an SQS queue subscribed to it
+completion_mode = os.getenv('TEXTRACT_COMPLETION_MODE', 'polling')
+sns_topic_arn = os.getenv('TEXTRACT_SNS_TOPIC_ARN')
+sns_role_arn = os.getenv('TEXTRACT_SNS_ROLE_ARN')
+sqs_queue_url = os.getenv('TEXTRACT_SQS_QUEUE_URL')
+# Page-1 fast path: send page 1 of every document to the synchronous detect_document_text and start the
+# full Textract job only when page 1 leaves fields for the Excel stage empty
+page_one_fast_path = os.getenv('TEXTRACT_PAGE_ONE_FAST_PATH', 'false').lower() in ('1', 'true', 'yes')
+# Size of the local cache of S3 objects in MB, shared by the scripts across runs; 0 reads everything from S3
+s3_cache_size = int(os.getenv('S3_CACHE_SIZE_MB', '256')) * 1024 * 1024
+# Run report (.json or .csv) and Prometheus text file written at the end of a run, if set
+metrics_report = os.getenv('METRICS_REPORT')
+metrics_prometheus = os.getenv('METRICS_PROMETHEUS')
 # Initialize the S3 and Textract clients
 try:
     s3_client = boto3.client('s3',
@@ -32,100 +63,249 @@ try:
                                    aws_access_key_id=aws_access_key_id,
                                    aws_secret_access_key=aws_secret_access_key,
                                    region_name=aws_region)
+    sqs_client = boto3.client('sqs',
+                              aws_access_key_id=aws_access_key_id,
+                              aws_secret_access_key=aws_secret_access_key,
+                              region_name=aws_region) if completion_mode == 'notifications' else None
 except (NoCredentialsError, PartialCredentialsError) as e:
     logger.error("AWS credentials not found or incomplete: %s", str(e))
     raise
+for client in (s3_client, textract_client, sqs_client):
+    if client is not None:
+        instrument_client(client, 'textract')
+# PDFs read for validation and the page-1 fast path, and the validation results
+s3_cache = S3ObjectCache(s3_client, 'textract', s3_cache_size)
+# Textract results already in the S3 results subfolder, listed once on first use
+existing_results = S3KeyIndex(s3_client, bucket_name, f"{results_dir}/", ttl=index_cache_ttl)
+# Page counts of PDFs validated in earlier runs, by ETag
+pdf_validations = ValidationCache(s3_client, bucket_name, validation_cache_key, object_cache=s3_cache)
+# Textract jobs of this and earlier runs, opened on first use
+job_store = JobStore(job_store_path)
 # Supported document extensions
 SUPPORTED_EXTENSIONS = ('.pdf', '.jpg', '.jpeg', '.png', '.tiff')
-# Get PDF files from S3 source subfolder
-def get_s3_files(bucket, subfolder):
+# Get PDF files from S3 source subfolder, lazily and one listing page at a time, as {'Key', 'ETag', ...} dicts
+def get_s3_objects(bucket, subfolder, start_after=None):
     try:
-        response = s3_client.list_objects_v2(Bucket=bucket, Prefix=subfolder)
-        files = [item['Key'] for item in response.get('Contents', []) if
-                 item['Key'].lower().endswith(SUPPORTED_EXTENSIONS)]
-        return files
+        yield from iter_s3_objects(s3_client, bucket, subfolder, suffixes=SUPPORTED_EXTENSIONS, start_after=start_after)
     except Exception as e:
         logger.error("Failed to list objects in S3 bucket: %s", str(e))
-        return []
+# Get the keys of the PDF files in S3 source subfolder
+def get_s3_files(bucket, subfolder, start_after=None):
+    for item in get_s3_objects(bucket, subfolder, start_after=start_after):
+        yield item['Key']
 # Check if the result file already exists in S3 results directory
 def result_exists(file_name):
     result_key = f"{results_dir}/{os.path.basename(file_name).replace('.pdf', '.json')}"
+    return result_key in existing_results
+# PDF validation - Check if PDF is corrupted.
+# In 'ranged' mode only the head and tail of the PDF are read; the whole file is read when they are inconclusive.
+# Results are cached by ETag, pass the ETag from the listing to skip even the ranged reads for known files.
+def validate_pdf(bucket, document, etag=None):
+    if etag is not None and etag in pdf_validations:
+        num_pages = pdf_validations.get(etag)
+        logger.info("%s was validated before: %s", document,
+                    f"valid PDF with {num_pages} pages" if num_pages is not None else "not a valid PDF")
+        return num_pages is not None
+    num_pages = data = head = None
     try:
-        s3_client.head_object(Bucket=bucket_name, Key=result_key)
-        return True
-    except Exception as e:
+        # A PDF already in the local cache is validated from there, without any request
+        if validation_mode == 'ranged' and not (etag and s3_cache.cached(bucket, document, etag)):
+            try:
+                head, tail, size, etag = read_object_ends(s3_client, bucket, document)
+            except ClientError as e:
+                # Empty objects cannot be read by range, the full read below handles them
+                if e.response['Error']['Code'] != 'InvalidRange':
+                    raise
+        if head is not None:
+            num_pages = count_pages_from_ends(head, tail, size)
+            if size <= len(tail):
+                data = tail
+        if num_pages is None and data is None:
+            data, etag = s3_cache.get(bucket, document, etag)
+    except (ClientError, BotoCoreError) as e:
+        # Failed reads, e.g. timeouts, say nothing about the PDF: they are not cached and the next run tries again
+        logger.error("Failed to read %s for validation. Error: %s", document, str(e))
         return False
-# PDF validation - Check if PDF is corrupted
-def validate_pdf(bucket, document):
-    local_path = f"/tmp/{os.path.basename(document)}"
-    try:
-        s3_client.download_file(bucket, document, local_path)
-        with open(local_path, 'rb') as f:
-            reader = PdfReader(f)
-            num_pages = len(reader.pages)
-            logger.info("%s is a valid PDF with %d pages.", document, num_pages)
-            return True
-    except Exception as e:
-        logger.error("%s is not a valid PDF. Error: %s", document, str(e))
-        return False
-    finally:
-        if os.path.exists(local_path):
-            os.remove(local_path)
-# Textract service
-def start_textract(bucket, document):
+    if num_pages is None:
+        try:
+            num_pages = count_pages(data)
+        except Exception as e:
+            logger.error("%s is not a valid PDF. Error: %s", document, str(e))
+            if etag is not None:
+                pdf_validations.set(etag, None)
+            return False
+    logger.info("%s is a valid PDF with %d pages.", document, num_pages)
+    if etag is not None:
+        pdf_validations.set(etag, num_pages)
+    return True
+# Textract service. The ETag of the document, read from S3 when not given, and its attempt make the start idempotent.
+def start_textract(bucket, document, etag=None):
+    kwargs = {}
+    if completion_mode == 'notifications':
+        kwargs['NotificationChannel'] = {'SNSTopicArn': sns_topic_arn, 'RoleArn': sns_role_arn}
     try:
+        if etag is None:
+            etag = s3_client.head_object(Bucket=bucket, Key=document)['ETag']
         response = textract_client.start_document_text_detection(
             DocumentLocation={
                 'S3Object': {
                     'Bucket': bucket,
                     'Name': document
                 }
-            }
+            },
+            ClientRequestToken=job_token(document, etag, job_store.attempt(document)),
+            **kwargs
         )
+        job_store.started(document, response['JobId'])
         return response['JobId']
     except Exception as e:
         logger.error("Failed to start Textract job on %s. Error: %s", document, str(e))
         raise
-# Getting textract results
-def get_textract_result(job_id):
-    while True:
-        response = textract_client.get_document_text_detection(JobId=job_id)
-        status = response['JobStatus']
-        if status in ['SUCCEEDED', 'FAILED']:
-            return response
-        logger.info("Waiting for Textract job %s to complete. Current status: %s", job_id, status)
-        time.sleep(5)
-# Saving results to S3 results subfolder
-def save_results(response, file_name):
-    local_path = os.path.join('/tmp', os.path.basename(file_name).replace('.pdf', '.json'))
-    s3_key = f"{results_dir}/{os.path.basename(local_path)}"
+# Getting textract results, page by page following NextToken
+def get_textract_result(job_id, response=None):
+    while response is None or response['JobStatus'] not in FINISHED_STATUSES:
+        if response is not None:
+            logger.info("Waiting for Textract job %s to complete. Current status: %s", job_id, response['JobStatus'])
+            time.sleep(5)
+        response = call_with_retry(textract_client.get_document_text_detection, JobId=job_id)
+    return iter_result_pages(textract_client, job_id, response)
+# Saving results to S3 results subfolder, streaming one Textract page at a time.
+# The page-1 LINE blocks are also saved as a small gzipped object for the Excel stage, with the ETag of the
+# result they belong to: the Excel stage reads the full result instead when they do not match.
+def save_results(pages, file_name):
+    s3_key = f"{results_dir}/{os.path.basename(file_name).replace('.pdf', '.json')}"
+    lines = []
     try:
-        with open(local_path, 'w') as f:
-            json.dump(response, f)
-        logger.info("Results saved to %s", local_path)
-        # Upload the JSON file back to S3
-        s3_client.upload_file(local_path, bucket_name, s3_key)
-        logger.info("Uploaded %s to S3 bucket %s", local_path, results_dir)
+        body = io.BufferedReader(IterStream(iter_result_json(collect_lines(pages, lines))), buffer_size=1024 * 1024)
+        s3_client.upload_fileobj(body, bucket_name, s3_key, ExtraArgs={'ContentType': 'application/json'})
+        logger.info("Uploaded results for %s to S3 bucket %s", file_name, results_dir)
+        existing_results.add(s3_key)
     except Exception as e:
         logger.error("Failed to save or upload results for %s. Error: %s", file_name, str(e))
-# Main function
-def process_documents(bucket, subfolder):
-    files = get_s3_files(bucket, subfolder)
-    for file in files:
+        return None
+    try:
+        etag = s3_client.head_object(Bucket=bucket_name, Key=s3_key)['ETag']
+        s3_client.put_object(Bucket=bucket_name, Key=get_lines_key(s3_key), Body=encode_lines(lines, etag),
+                             ContentType='application/gzip')
+    except Exception as e:
+        # The result is saved, the Excel stage reads it in full without its LINE object
+        logger.warning("Failed to save the LINE object of %s. Error: %s", file_name, str(e))
+    return s3_key
+# Yield documents which still need Textract, validating them only when a job slot frees up.
+# Documents with a resumed job are skipped, their job is already running, and so are repeated ones.
+# None items (no document ready yet) are passed through to the scheduler.
+# The ETags of the listed documents are recorded in etags, if given.
+def pending_documents(bucket, objects, resumed=(), etags=None):
+    seen = set()
+    for item in objects:
+        if item is None:
+            yield None
+            continue
+        file = item['Key']
+        if file in resumed or file in seen:
+            continue
+        seen.add(file)
+        if etags is not None and item.get('ETag'):
+            etags[file] = item['ETag']
         result_key = f"{results_dir}/{os.path.basename(file).replace('.pdf', '.json')}"
         if result_exists(result_key):
             logger.info("Skipping %s as result already exists.", file)
             continue
-        if file.lower().endswith('.pdf') and not validate_pdf(bucket, file):
+        if file.lower().endswith('.pdf'):
+            with metrics.timer('textract', 'validate_pdf', file):
+                valid = validate_pdf(bucket, file, item.get('ETag'))
+        else:
+            valid = True
+        if not valid:
             logger.warning("Skipping invalid PDF file: %s", file)
             continue
         logger.info("Processing %s", file)
-        try:
-            job_id = start_textract(bucket, file)
-            response = get_textract_result(job_id)
-            save_results(response, file)
-        except textract_client.exceptions.UnsupportedDocumentException as e:
-            logger.error("Failed to process %s. Error: %s", file, str(e))
-        except Exception as e:
-            logger.error("An unexpected error occurred while processing %s. Error: %s", file, str(e))
-process_documents(bucket_name, subfolder)
\ No newline at end of file
+        yield file
+# Detect the text of page 1 of a document with one synchronous Textract call and save it as the result when it
+# holds everything the Excel stage needs. Returns the S3 key of the saved result, or None if a job is needed.
+def detect_page_one(bucket, document):
+    result_key = f"{results_dir}/{os.path.basename(document).replace('.pdf', '.json')}"
+    try:
+        body = s3_cache.read(bucket, document)
+        page = extract_first_page(body) if document.lower().endswith('.pdf') else body
+        response = call_with_retry(textract_client.detect_document_text, Document={'Bytes': page})
+        missing = find_missing_fields(response['Blocks'], result_key)
+    except Exception as e:
+        # Anything unexpected on page 1 only means the document goes through a job
+        logger.warning("Page-1 fast path failed for %s, starting a Textract job. Error: %s", document, str(e))
+        return None
+    if missing:
+        logger.info("Page 1 of %s is missing %s, starting a Textract job.", document, ", ".join(missing))
+        return None
+    return save_results(iter([response]), document)
+# Finish documents through the page-1 fast path and pass on the ones which still need a Textract job
+def fast_path_documents(bucket, documents, on_saved=None):
+    for document in documents:
+        if document is None:
+            yield None
+            continue
+        with metrics.timer('textract', 'page_one', document):
+            result_key = detect_page_one(bucket, document)
+        if not result_key:
+            yield document
+        elif on_saved:
+            on_saved(document, result_key)
+# Save results of a finished Textract job, returns the S3 key of the saved result
+def handle_result(document, job_id, response):
+    if response['JobStatus'] == 'FAILED':
+        logger.error("Textract job failed for %s. Error: %s", document, response.get('StatusMessage'))
+        job_store.failed(document)
+        return None
+    with metrics.timer('textract', 'save_results', document):
+        result_key = save_results(get_textract_result(job_id, response), document)
+    if result_key:
+        job_store.update(document, SAVED, result_key)
+    return result_key
+# Main function.
+# - new_documents: optional iterable of {'Key': ...} dicts of documents arriving during the run, processed after
+#   the ones already in the subfolder; it may yield None while no document is ready
+# - on_saved(document, result_key): optional callback for every saved result
+def process_documents(bucket, subfolder, new_documents=None, on_saved=None):
+    resumed = resumable_jobs(job_store, textract_client)
+    for document in list(resumed):
+        # Saved before the interruption, but not yet marked as saved
+        result_key = f"{results_dir}/{os.path.basename(document).replace('.pdf', '.json')}"
+        if result_exists(result_key):
+            job_store.update(document, SAVED, result_key)
+            del resumed[document]
+    objects = get_s3_objects(bucket, subfolder)
+    if new_documents is not None:
+        objects = itertools.chain(objects, new_documents)
+
+    def on_result(document, job_id, response):
+        result_key = handle_result(document, job_id, response)
+        if result_key and on_saved:
+            on_saved(document, result_key)
+
+    etags = {}
+    documents = pending_documents(bucket, objects, resumed, etags)
+    if page_one_fast_path:
+        documents = fast_path_documents(bucket, documents, on_saved)
+
+    if completion_mode == 'notifications':
+        run_textract_jobs_notified(textract_client,
+                                   sqs_client,
+                                   sqs_queue_url,
+                                   documents,
+                                   lambda document: start_textract(bucket, document, etags.get(document)),
+                                   on_result,
+                                   max_in_flight=max_in_flight,
+                                   resume=resumed)
+    else:
+        run_textract_jobs(textract_client,
+                          documents,
+                          lambda document: start_textract(bucket, document, etags.get(document)),
+                          on_result,
+                          max_in_flight=max_in_flight,
+                          resume=resumed)
+    existing_results.save()
+    pdf_validations.save()
+
+if __name__ == '__main__':
+    process_documents(bucket_name, subfolder)
+    metrics.write_reports(metrics_report, metrics_prometheus)
@@ -0,0 +1,154 @@
+import asyncio
+import contextlib
+import hashlib
+import logging
+import random
+from urllib.parse import urljoin, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Create a requests session with a connection pool shared by all crawler threads
+def create_session(pool_size=20):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Get absolute pdf links from the HTML of a page
+def parse_pdf_links(content, page_url):
+    # Imported here, so importing the crawler helpers does not load bs4
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, 'html.parser')
+    pdf_links = []
+    for link in soup.find_all('a', href=True):
+        href = link['href']
+        if href.lower().endswith('.pdf'):
+            pdf_links.append(urljoin(page_url, href))
+    return pdf_links
+
+# Build conditional request headers from the validators of an earlier download, so an unchanged file
+# is answered with 304 Not Modified instead of its content
+def conditional_headers(validators):
+    headers = {}
+    if validators and validators.get('ETag'):
+        headers['If-None-Match'] = validators['ETag']
+    if validators and validators.get('Last-Modified'):
+        headers['If-Modified-Since'] = validators['Last-Modified']
+    return headers
+
+# Read-only file object over a streamed response body that hashes the content as it is read.
+# Lets upload_fileobj stream a download in chunks while the SHA-256 of the whole file is computed on the fly.
+class HashingReader:
+    def __init__(self, raw):
+        self.raw = raw
+        self.hash = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.raw.read(size if size is not None and size >= 0 else None)
+        self.hash.update(data)
+        self.size += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+# Asyncio crawler over a pooled requests session. Blocking requests run in worker threads,
+# limited per host, and failed requests are retried with jittered exponential backoff.
+class Crawler:
+    def __init__(self, session, per_host_limit=4, max_retries=4, backoff=1.0, timeout=60):
+        self.session = session
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.host_semaphores = {}
+
+    # Slot of the host of a url, at most per_host_limit are taken at a time. fetch takes one per request;
+    # hold one around fetch(..., in_slot=True) and the read of the body to count a streamed download as a whole.
+    def host_slot(self, url):
+        host = urlparse(url).netloc
+        return self.host_semaphores.setdefault(host, asyncio.Semaphore(self.per_host_limit))
+
+    # GET a url and return the response, retrying connection errors and RETRY_STATUSES.
+    # in_slot: the caller already holds the host slot of url, see host_slot
+    async def fetch(self, url, in_slot=False, **kwargs):
+        slot = contextlib.nullcontext() if in_slot else self.host_slot(url)
+        kwargs.setdefault('timeout', self.timeout)
+        for attempt in range(self.max_retries + 1):
+            async with slot:
+                try:
+                    metrics.count_call('http', 'GET')
+                    response = await asyncio.to_thread(self.session.get, url, **kwargs)
+                    if response.status_code not in RETRY_STATUSES:
+                        try:
+                            response.raise_for_status()
+                        except requests.HTTPError:
+                            # A streamed response keeps its connection until closed
+                            response.close()
+                            raise
+                        return response
+                    error = requests.HTTPError(f"{response.status_code} for {url}", response=response)
+                    response.close()
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1)
+            logger.warning("Request to %s failed, retrying in %.1f seconds. Error: %s", url, delay, str(error))
+            await asyncio.sleep(delay)
+
+    # Yield new pdf links of listing pages page=0, 1, ... until a page has no new links.
+    # page_window pages are fetched ahead concurrently, but handled in page order.
+    async def iter_pdf_links(self, base_url, page_window=4, max_pages=None):
+        seen = set()
+        page = 0
+        while max_pages is None or page < max_pages:
+            last_page = page + page_window if max_pages is None else min(page + page_window, max_pages)
+            page_urls = [f"{base_url}?page={number}" for number in range(page, last_page)]
+            responses = await asyncio.gather(*(self.fetch(page_url) for page_url in page_urls))
+            for page_url, response in zip(page_urls, responses):
+                new_links = [link for link in parse_pdf_links(response.content, page_url) if link not in seen]
+                if not new_links:
+                    logger.info("No new pdf links on %s, crawl finished.", page_url)
+                    return
+                seen.update(new_links)
+                for link in new_links:
+                    yield link
+            page = last_page
+
+    # Crawl all listing pages and hand every pdf link to download(crawler, url), a coroutine.
+    # Links go through a bounded queue to download_workers concurrent downloads.
+    async def crawl(self, base_url, download, download_workers=8, queue_size=100, page_window=4, max_pages=None):
+        queue = asyncio.Queue(maxsize=queue_size)
+        failed = []
+
+        async def worker():
+            while True:
+                url = await queue.get()
+                try:
+                    if url is None:
+                        return
+                    await download(self, url)
+                except Exception as e:
+                    logger.error("Failed to download %s. Error: %s", url, str(e))
+                    failed.append(url)
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(download_workers)]
+        try:
+            async for url in self.iter_pdf_links(base_url, page_window=page_window, max_pages=max_pages):
+                await queue.put(url)
+        finally:
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        return failed
@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import sqlite3
+import time
+from botocore.exceptions import ClientError
+from utils.scheduler import call_with_retry
+
+logger = logging.getLogger(__name__)
+
+# Job statuses recorded by the stage on top of Textract's own: SAVED once the result is in S3, EXPIRED for jobs
+# Textract no longer has
+SAVED = 'SAVED'
+EXPIRED = 'EXPIRED'
+# Statuses of jobs which need nothing more from Textract
+DONE_STATUSES = (SAVED, 'FAILED', EXPIRED)
+
+# ClientRequestToken of a Textract job: one per version of a document and attempt. Textract answers a start with
+# a token it has seen with the JobId of that job, so a start repeated after a crash, before the job was recorded,
+# is not billed twice, while a changed document gets a job of its own. The attempt (see JobStore.attempt) moves
+# on when a job fails, so the next start runs a new job instead of getting the failed one back.
+def job_token(document, etag, attempt=0):
+    return hashlib.sha256(f"{document}/{etag}/{attempt}".encode('utf-8')).hexdigest()
+
+# Durable document -> JobId -> status -> result key ledger of Textract jobs, kept in a local SQLite file.
+# Every change is committed at once, so a crashed or recycled run can re-attach to its jobs instead of
+# starting (and paying for) them again. The file is opened on first use, so creating a store writes nothing.
+class JobStore:
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+
+    def open(self):
+        if self.connection is None:
+            # Used by one thread at a time, but not necessarily the one that opened it (e.g. in pipeline)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "document TEXT PRIMARY KEY, job_id TEXT NOT NULL, status TEXT NOT NULL, result_key TEXT, "
+                "started_at REAL NOT NULL, updated_at REAL NOT NULL, attempt INTEGER NOT NULL DEFAULT 0)"
+            )
+            # Stores written before attempts were recorded
+            columns = [row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")]
+            if 'attempt' not in columns:
+                self.connection.execute("ALTER TABLE jobs ADD COLUMN attempt INTEGER NOT NULL DEFAULT 0")
+            self.connection.commit()
+        return self.connection
+
+    # Record a newly started job. The attempt of the document is kept.
+    def started(self, document, job_id):
+        now = time.time()
+        with self.open():
+            self.connection.execute(
+                "INSERT INTO jobs (document, job_id, status, result_key, started_at, updated_at) "
+                "VALUES (?, ?, 'IN_PROGRESS', NULL, ?, ?) ON CONFLICT (document) DO UPDATE SET "
+                "job_id = excluded.job_id, status = excluded.status, result_key = NULL, "
+                "started_at = excluded.started_at, updated_at = excluded.updated_at", (document, job_id, now, now))
+
+    # Record the Textract status of a job, or SAVED with the key of its saved result
+    def update(self, document, status, result_key=None):
+        with self.open():
+            self.connection.execute("UPDATE jobs SET status = ?, result_key = COALESCE(?, result_key), updated_at = ? "
+                                    "WHERE document = ?", (status, result_key, time.time(), document))
+
+    # Record that the job of a document failed, and move on to the next attempt for its next start
+    def failed(self, document):
+        with self.open():
+            self.connection.execute("UPDATE jobs SET status = 'FAILED', attempt = attempt + 1, updated_at = ? "
+                                    "WHERE document = ?", (time.time(), document))
+
+    # Number of failed jobs of a document, the attempt its next job is started as
+    def attempt(self, document):
+        row = self.open().execute("SELECT attempt FROM jobs WHERE document = ?", (document,)).fetchone()
+        return row[0] if row else 0
+
+    # Forget the job of a document, e.g. an expired one, so the document is started again as a new attempt
+    def forget(self, document):
+        with self.open():
+            self.connection.execute("UPDATE jobs SET status = ?, attempt = attempt + 1, updated_at = ? "
+                                    "WHERE document = ?", (EXPIRED, time.time(), document))
+
+    def get(self, document):
+        row = self.open().execute("SELECT job_id, status, result_key FROM jobs WHERE document = ?",
+                                  (document,)).fetchone()
+        return {'JobId': row[0], 'JobStatus': row[1], 'ResultKey': row[2]} if row else None
+
+    # {document: JobId} of jobs started but not finished and saved
+    def unfinished(self):
+        rows = self.open().execute(f"SELECT document, job_id FROM jobs WHERE status NOT IN "
+                                   f"({', '.join('?' * len(DONE_STATUSES))}) ORDER BY started_at", DONE_STATUSES)
+        return dict(rows.fetchall())
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+# Check the unfinished jobs of earlier runs with Textract and return {document: JobId} of those it still knows.
+# Jobs Textract no longer has (results expire after 7 days) are forgotten, so their documents start over.
+def resumable_jobs(store, textract_client, sleep=time.sleep):
+    jobs = {}
+    for document, job_id in store.unfinished().items():
+        try:
+            response = call_with_retry(textract_client.get_document_text_detection, JobId=job_id, MaxResults=1,
+                                       sleep=sleep)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'InvalidJobIdException':
+                raise
+            logger.warning("Textract job %s for %s has expired, it will be started again.", job_id, document)
+            store.forget(document)
+            continue
+        store.update(document, response['JobStatus'])
+        logger.info("Re-attaching to Textract job %s for %s. Current status: %s", job_id, document,
+                    response['JobStatus'])
+        jobs[document] = job_id
+    return jobs
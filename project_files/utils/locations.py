@@ -0,0 +1,111 @@
+import bisect
+from collections import Counter
+
+# Column positions (0-based) in the Locations sheet
+OPERATOR_ID = 0
+COMPANY_ID = 1
+RESPONSIBLE_PERSON = 3
+STREET = 4
+
+# In-memory index of the Locations sheet, built with a single pass over the sheet.
+# Rows appended through the index are written to the sheet and indexed right away,
+# so lookups never have to scan the sheet again.
+class LocationsIndex:
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.rows = {}          # row number -> row values
+        self.person_rows = {}   # stripped Responsible Person -> sorted row numbers
+        self.operator_ids = Counter()
+        self.company_numbers = Counter()
+        self.max_operator_id = None
+        self.max_company_number = None
+        self.empty_rows = []    # sorted row numbers with an empty Operator ID cell
+        self.last_row = max(sheet.max_row, 1)
+        for row_number, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
+            self._add(row_number, row)
+
+    def _add(self, row_number, row):
+        self.rows[row_number] = row
+        if row and len(row) > RESPONSIBLE_PERSON and row[RESPONSIBLE_PERSON]:
+            bisect.insort(self.person_rows.setdefault(row[RESPONSIBLE_PERSON].strip(), []), row_number)
+        operator_id = self._operator_id(row)
+        if operator_id is not None:
+            self.operator_ids[operator_id] += 1
+            if self.max_operator_id is None or operator_id > self.max_operator_id:
+                self.max_operator_id = operator_id
+        company_number = self._company_number(row)
+        if company_number is not None:
+            self.company_numbers[company_number] += 1
+            if self.max_company_number is None or company_number > self.max_company_number:
+                self.max_company_number = company_number
+        if not row or not row[OPERATOR_ID]:
+            bisect.insort(self.empty_rows, row_number)
+
+    @staticmethod
+    def _operator_id(row):
+        return row[OPERATOR_ID] if row else None
+
+    @staticmethod
+    def _company_number(row):
+        if row and len(row) > COMPANY_ID and row[COMPANY_ID] and row[COMPANY_ID].startswith('C'):
+            return int(row[COMPANY_ID][1:])
+        return None
+
+    def _remove(self, row_number):
+        row = self.rows.pop(row_number, None)
+        if row and len(row) > RESPONSIBLE_PERSON and row[RESPONSIBLE_PERSON]:
+            self.person_rows[row[RESPONSIBLE_PERSON].strip()].remove(row_number)
+        # Overwritten IDs no longer count towards the next free ID
+        operator_id = self._operator_id(row)
+        if operator_id is not None:
+            self.operator_ids[operator_id] -= 1
+            if not self.operator_ids[operator_id]:
+                del self.operator_ids[operator_id]
+                self.max_operator_id = max(self.operator_ids) if self.operator_ids else None
+        company_number = self._company_number(row)
+        if company_number is not None:
+            self.company_numbers[company_number] -= 1
+            if not self.company_numbers[company_number]:
+                del self.company_numbers[company_number]
+                self.max_company_number = max(self.company_numbers) if self.company_numbers else None
+        index = bisect.bisect_left(self.empty_rows, row_number)
+        if index < len(self.empty_rows) and self.empty_rows[index] == row_number:
+            del self.empty_rows[index]
+
+    # All rows of a Responsible Person, in sheet order
+    def find_rows(self, responsible_person):
+        return [self.rows[row_number] for row_number in self.person_rows.get(responsible_person.strip(), [])]
+
+    # First row of a Responsible Person at the given street address, or None
+    def find_address(self, responsible_person, street):
+        for row in self.find_rows(responsible_person):
+            if row[STREET].strip() == street:
+                return row
+        return None
+
+    # Next available Operator ID
+    def next_operator_id(self):
+        return (self.max_operator_id + 1) if self.max_operator_id is not None else 1
+
+    # Next available Company ID
+    def next_company_id(self):
+        return f"C{(self.max_company_number + 1) if self.max_company_number is not None else 1}"
+
+    # First row with an empty Operator ID cell, same as find_first_empty_row
+    def next_free_row(self):
+        return self.empty_rows[0] if self.empty_rows else self.last_row + 1
+
+    # Write a new location into the first free row and index it
+    def append(self, values):
+        row_number = self.next_free_row()
+        for col, value in enumerate(values, start=1):
+            self.sheet.cell(row=row_number, column=col, value=value)
+        # openpyxl leaves a cell unchanged when it is written with None, so keep the old values there
+        old_row = self.rows.get(row_number) or ()
+        row = tuple(value if value is not None or col >= len(old_row) else old_row[col]
+                    for col, value in enumerate(values))
+        row = row + tuple(old_row[len(row):])
+        self._remove(row_number)
+        self._add(row_number, row)
+        self.last_row = max(self.last_row, row_number)
+        return row_number
@@ -0,0 +1,183 @@
+import csv
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Quantiles reported for every timing
+QUANTILES = (0.5, 0.9, 0.99)
+
+# Value at quantile q of sorted values, nearest rank
+def quantile(values, q):
+    return values[min(len(values) - 1, max(0, int(round(q * len(values))) - 1))]
+
+# Timings, API calls and bytes moved by the stages of a run, collected from any thread.
+# - timings: per (stage, operation), with the document they belong to, for per-document latencies
+# - api calls: per (service, operation), e.g. ('s3', 'GetObject') or ('http', 'GET')
+# - bytes: per (stage, direction), e.g. ('download', 'http_in') or ('excel', 's3_in')
+# - counters: any other event per (stage, name), e.g. ('excel', 's3_cache_hit')
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.timings = []                   # (stage, operation, document, seconds)
+        self.api_calls = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.counters = defaultdict(int)
+
+    # Start over, e.g. for the next invocation of a warm handler
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.timings = []
+            self.api_calls.clear()
+            self.bytes.clear()
+            self.counters.clear()
+
+    def observe(self, stage, operation, seconds, document=None):
+        with self.lock:
+            self.timings.append((stage, operation, document, seconds))
+
+    @contextmanager
+    def timer(self, stage, operation, document=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, operation, time.perf_counter() - start, document)
+
+    def count_call(self, service, operation, count=1):
+        with self.lock:
+            self.api_calls[(service, operation)] += count
+
+    def add_bytes(self, stage, direction, count):
+        with self.lock:
+            self.bytes[(stage, direction)] += count
+
+    def count(self, stage, name, count=1):
+        with self.lock:
+            self.counters[(stage, name)] += count
+
+    # Summary of the run: count, total, mean, quantiles and max of every timing, API calls, bytes and counters
+    def summary(self):
+        with self.lock:
+            grouped = defaultdict(list)
+            for stage, operation, document, seconds in self.timings:
+                grouped[(stage, operation)].append(seconds)
+            timings = {}
+            for (stage, operation), values in sorted(grouped.items()):
+                values.sort()
+                timing = {'count': len(values), 'total': sum(values), 'mean': sum(values) / len(values),
+                          'max': values[-1]}
+                timing.update({f"p{int(q * 100)}": quantile(values, q) for q in QUANTILES})
+                timings[f"{stage}.{operation}"] = timing
+            return {
+                'started_at': self.started_at,
+                'duration': time.time() - self.started_at,
+                'timings': timings,
+                'api_calls': {f"{service}.{operation}": count for (service, operation), count in sorted(self.api_calls.items())},
+                'bytes': {f"{stage}.{direction}": count for (stage, direction), count in sorted(self.bytes.items())},
+                'counters': {f"{stage}.{name}": count for (stage, name), count in sorted(self.counters.items())},
+            }
+
+    # Summary plus every single timing, for per-document latencies
+    def write_json(self, path):
+        report = self.summary()
+        with self.lock:
+            report['observations'] = [{'stage': stage, 'operation': operation, 'document': document, 'seconds': seconds}
+                                      for stage, operation, document, seconds in self.timings]
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    # One row per timing, API call counter, byte counter and other counter
+    def write_csv(self, path):
+        with self.lock:
+            rows = [('timing', stage, operation, document or '', seconds)
+                    for stage, operation, document, seconds in self.timings]
+            rows += [('api_calls', service, operation, '', count) for (service, operation), count in sorted(self.api_calls.items())]
+            rows += [('bytes', stage, direction, '', count) for (stage, direction), count in sorted(self.bytes.items())]
+            rows += [('counter', stage, name, '', count) for (stage, name), count in sorted(self.counters.items())]
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(('kind', 'stage', 'name', 'document', 'value'))
+            writer.writerows(rows)
+
+    # Prometheus text exposition format, e.g. for the node_exporter textfile collector
+    def prometheus_text(self, prefix='waivers'):
+        summary = self.summary()
+        lines = [f"# TYPE {prefix}_operation_seconds summary"]
+        for name, timing in summary['timings'].items():
+            stage, operation = name.split('.', 1)
+            labels = f'stage="{stage}",operation="{operation}"'
+            for q in QUANTILES:
+                lines.append(f'{prefix}_operation_seconds{{{labels},quantile="{q}"}} {timing[f"p{int(q * 100)}"]}')
+            lines.append(f"{prefix}_operation_seconds_sum{{{labels}}} {timing['total']}")
+            lines.append(f"{prefix}_operation_seconds_count{{{labels}}} {timing['count']}")
+        lines.append(f"# TYPE {prefix}_api_calls_total counter")
+        for name, count in summary['api_calls'].items():
+            service, operation = name.split('.', 1)
+            lines.append(f'{prefix}_api_calls_total{{service="{service}",operation="{operation}"}} {count}')
+        lines.append(f"# TYPE {prefix}_bytes_total counter")
+        for name, count in summary['bytes'].items():
+            stage, direction = name.split('.', 1)
+            lines.append(f'{prefix}_bytes_total{{stage="{stage}",direction="{direction}"}} {count}')
+        lines.append(f"# TYPE {prefix}_events_total counter")
+        for name, count in summary['counters'].items():
+            stage, name = name.split('.', 1)
+            lines.append(f'{prefix}_events_total{{stage="{stage}",name="{name}"}} {count}')
+        lines.append(f"# TYPE {prefix}_run_duration_seconds gauge")
+        lines.append(f"{prefix}_run_duration_seconds {summary['duration']}")
+        return "\n".join(lines) + "\n"
+
+    # Write the run report (JSON or CSV, by extension) and the Prometheus text file, each if a path is given
+    def write_reports(self, report_path=None, prometheus_path=None):
+        if report_path:
+            if report_path.lower().endswith('.csv'):
+                self.write_csv(report_path)
+            else:
+                self.write_json(report_path)
+        if prometheus_path:
+            with open(prometheus_path, 'w') as f:
+                f.write(self.prometheus_text())
+
+# Metrics of this process, shared by all stages
+metrics = Metrics()
+
+# Size of a request body: bytes, or a seekable file object read from its current position
+def body_size(body):
+    if body is None:
+        return 0
+    try:
+        return len(body)
+    except TypeError:
+        pass
+    try:
+        position = body.tell()
+        end = body.seek(0, 2)
+        body.seek(position)
+        return end - position
+    except (AttributeError, OSError):
+        return 0
+
+# Count the API calls of a boto3 client and time them per operation; for S3 also count the bytes sent and received
+def instrument_client(client, stage, registry=metrics):
+    service = client.meta.service_model.service_name
+
+    def before_call(model, params, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+        # params is the serialized request here, with a bytes or file-like body
+        if service == 's3' and model.name in ('PutObject', 'UploadPart'):
+            registry.add_bytes(stage, 's3_out', body_size(params.get('body')))
+
+    def after_call(http_response, model, context, **kwargs):
+        registry.count_call(service, model.name)
+        if 'metrics_start' in context:
+            registry.observe(stage, f"{service}.{model.name}", time.perf_counter() - context['metrics_start'])
+        if service == 's3' and model.name == 'GetObject':
+            registry.add_bytes(stage, 's3_in', int(http_response.headers.get('Content-Length', 0)))
+
+    event_name = client.meta.service_model.service_id.hyphenize()
+    client.meta.events.register(f"before-call.{event_name}", before_call)
+    client.meta.events.register(f"after-call.{event_name}", after_call)
+    return client
@@ -2,6 +2,9 @@
 # import os
 # from dotenv import load_dotenv
 import re
+from datetime import date
+from functools import lru_cache
+from dateutil import parser
 
 # # Load environment variables from .env file
 # load_dotenv()
@@ -52,16 +55,37 @@ waiver_codes = {
     "107.145": "Over Moving Vehicles"
 }
 
-# Function to check for waiver codes in a string
-def check_waiver_codes(entry):
-    result = {name: '' for name in waiver_codes.values()}
-    for code, name in waiver_codes.items():
+# Build one pattern matching every waiver code, with a named group per code.
+# "107.51" stands for 107.51(b), (c) and (d); OCR sometimes drops the leading 1 ("07.")
+def compile_waiver_code_pattern(codes):
+    group_names = {}
+    code_patterns = []
+    limitations_pattern = None
+    for index, (code, name) in enumerate(codes.items()):
+        group = f"code{index}"
+        group_names[group] = name
         if code == "107.51":
-            pattern = re.compile(r'(107|07)\.51\((b|c|d)\)')
+            limitations_pattern = rf"(?P<{group}>(?:107|07)\.51\([bcd]\))"
         else:
-            pattern = re.compile(r'(?<!\d)(107|07)\.' + re.escape(code[4:]).replace(r'\.', r'\.') + r'(?!\d)')
-        if pattern.search(entry):
+            code_patterns.append(rf"(?P<{group}>{re.escape(code[4:])})(?!\d)")
+    pattern = rf"(?<!\d)(?:107|07)\.(?:{'|'.join(code_patterns)})"
+    if limitations_pattern:
+        pattern += "|" + limitations_pattern
+    return re.compile(pattern), group_names
+
+waiver_code_pattern, waiver_code_groups = compile_waiver_code_pattern(waiver_codes)
+
+# Function to check for waiver codes in a string, in a single pass over it
+def check_waiver_codes(entry):
+    result = {name: '' for name in waiver_codes.values()}
+    found = 0
+    for match in waiver_code_pattern.finditer(entry):
+        name = waiver_code_groups[match.lastgroup]
+        if not result[name]:
             result[name] = '+'
+            found += 1
+            if found == len(result):
+                break
     return result
 
 state_mapping = {
@@ -79,4 +103,222 @@ state_mapping = {
 
 # Function to convert state code to state name
 def convert_state_code_to_name(state_code):
-    return state_mapping.get(state_code.upper(), "Invalid state code")
\ No newline at end of file
+    return state_mapping.get(state_code.upper(), "Invalid state code")
+
+# Defining strings to be removed from objects
+string_remove = {
+    "location": "This certificate is issued for the operations specifically described hereinafter. No person shall conduct any operation pursuant to the"
+}
+
+# Used to create unformatted address
+def strip_and_merge(strings_list):
+    # Strip whitespace from each string in the list
+    stripped_strings = [s.strip() for s in strings_list]
+    # Merge the stripped strings with '/'
+    merged_string = '/'.join(stripped_strings)
+    return merged_string
+
+# Section grammar of the first page of a certificate of waiver: (keyword, kind, field).
+# Keywords are checked in this order and the first one found in a line wins; a keyword line is never captured.
+# - capture: the following lines are captured into field, see waiver_captures
+# - value: field is the text after the first ':' of the line
+# - dates: the line holds the effective and expire dates (keyword matched case-insensitively)
+waiver_sections = (
+    ("ISSUED TO", "capture", "Issued To"),
+    ("ADDRESS", "capture", "Address"),
+    ("Responsible Person:", "value", "Responsible Person"),
+    ("Responsible Party:", "value", "Responsible Person"),
+    ("Waiver Number:", "value", "Waiver Number"),
+    ("OPERATIONS AUTHORIZED", "capture", "Operations Authorized"),
+    ("LIST OF WAIVED REGULATIONS BY SECTION AND TITLE", "capture", "List of Waived Regulations"),
+    ("effective from", "dates", None),
+)
+
+# How captured sections end: (number of lines, end marker). A section with a line count is set once
+# all of its lines are read; an open-ended one restarts at its keyword and ends with the line holding
+# the end marker (that line is still captured) or at the next capturing keyword.
+waiver_captures = {
+    "Issued To": (1, None),
+    "Address": (3, None),
+    "Operations Authorized": (None, "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE"),
+    "List of Waived Regulations": (None, "STANDARD PROVISIONS"),
+}
+
+# Single-pass parser for the page-1 LINE blocks of a waiver, built once from the section grammar
+class WaiverParser:
+    def __init__(self, sections, captures):
+        self.sections = sections
+        self.captures = captures
+        # One combined pattern tells if a line holds any keyword at all; most lines do not
+        self.keyword_pattern = re.compile("|".join(
+            f"(?i:{re.escape(keyword)})" if kind == "dates" else re.escape(keyword)
+            for keyword, kind, field in sections))
+
+    # Find the grammar entry of a line, or None for a plain text line
+    def classify(self, text):
+        if not self.keyword_pattern.search(text):
+            return None
+        for keyword, kind, field in self.sections:
+            if keyword in (text.lower() if kind == "dates" else text):
+                return kind, field
+        return None
+
+    def parse(self, blocks, key):
+        info = {
+            "Issued To": "",
+            "Responsible Person": "",
+            "Address": "",
+            "Street Name and Number": "",
+            "City": "",
+            "State": "",
+            "Zip Code": "",
+            "Waiver Number": "",
+            "Operations Authorized": "",
+            "List of Waived Regulations": "",
+            "Effective Date": "",
+            "Expire Date": "",
+            "Waiver URL": ""
+        }
+        info["Waiver URL"] = key.replace("json", "pdf").replace("waivers-pdf", "https://www.faa.gov/sites/faa.gov/files/")
+
+        sections = {}           # open-ended section -> captured lines
+        capture_next = None     # section the next plain line belongs to
+        captured = []           # lines of the current fixed-length section
+
+        for block in blocks:
+            if block.get('Page', 1) > 1:
+                break  # blocks are ordered by page and only page 1 is needed
+            if block['BlockType'] != 'LINE':
+                continue
+            text = block['Text']
+
+            entry = self.classify(text)
+            if entry:
+                kind, field = entry
+                if kind == "capture":
+                    capture_next = field
+                    captured = []
+                    if self.captures[field][0] is None:
+                        sections[field] = []
+                elif kind == "value":
+                    info[field] = text.split(":", 1)[1].strip()
+                else:
+                    parse_waiver_dates(text, info)
+            elif capture_next:
+                line_count, end_marker = self.captures[capture_next]
+                if line_count is None:
+                    sections[capture_next].append(text)
+                    if end_marker in text:
+                        capture_next = None
+                else:
+                    captured.append(text)
+                    if len(captured) == line_count:
+                        if capture_next == "Address":
+                            parse_address(captured, info)
+                        else:
+                            info[capture_next] = " ".join(captured)
+                        capture_next = None
+
+        for field, lines in sections.items():
+            info[field] = " ".join(lines)
+        for field in info.keys():
+            info[field] = info[field].strip()
+
+        # Remove 'STANDARD PROVISIONS' from the final output if it was appended
+        if "STANDARD PROVISIONS" in info["List of Waived Regulations"]:
+            info["List of Waived Regulations"] = info["List of Waived Regulations"].replace("STANDARD PROVISIONS",
+                                                                                            "").strip()
+
+        # Remove 'LIST OF WAIVED REGULATIONS BY SECTION AND TITLE' from the final output if it was appended
+        if "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE" in info["Operations Authorized"]:
+            info["Operations Authorized"] = info["Operations Authorized"].replace(
+                "LIST OF WAIVED REGULATIONS BY SECTION AND TITLE", "").strip()
+
+        # Remove redundant string from ["Address"]
+        if string_remove["location"] in info["Address"]:
+            info["Address"] = info["Address"].replace(
+                string_remove["location"], "").strip()
+
+        return info
+
+# Parse the effective and expire dates from the "effective from ... to ..." line
+def parse_waiver_dates(text, info):
+    date_parts = text.split("effective from", 1)[1].split(" to ", 1)
+    if len(date_parts) == 2:
+        today = date.today()
+        info["Effective Date"] = format_date(date_parts[0].strip(), today)
+        info["Expire Date"] = format_date(date_parts[1].strip().split(",")[0].strip(), today)
+
+# Parse a date and format it as MM/DD/YYYY. Waivers share a small set of dates, so results are cached;
+# today is part of the key because dateutil fills missing parts of a date from it.
+@lru_cache(maxsize=4096)
+def format_date(text, today):
+    return parser.parse(text).strftime('%m/%d/%Y')
+
+# Split the three captured address lines into street, city, state and zip code
+def parse_address(lines, info):
+    address_line = [text + " " for text in lines]
+    info["Address"] = strip_and_merge(address_line)
+    address_components = info["Address"]  # get_address(info["Address"])
+    if address_components:
+        if len(address_line[2]) > 40:  # Case when we have three-row address
+            street_and_number, rest = address_components.split("/", 1)
+            cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
+            # Replace multiple spaces with a single space
+            info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
+            info["City"], rest = rest.split(",", 1)
+            state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest)
+
+            if state_zip:
+                info["State"] = convert_state_code_to_name(state_zip.group(1))
+                info["Zip Code"] = state_zip.group(2)
+        else:
+            street_and_number = address_line[0] + '/' + address_line[1]
+            cleaned_street_and_number = re.sub(r'[.,/]', '', street_and_number)
+            # Replace multiple spaces with a single space
+            info["Street Name and Number"] = re.sub(r'\s+', ' ', cleaned_street_and_number)
+
+            city_state_zip = address_line[2]
+            info["City"], rest = city_state_zip.split(",", 1)
+            state_zip = re.search(r'([A-Z]{2}) (\d{5})', rest.strip())
+            if state_zip:
+                info["State"] = convert_state_code_to_name(state_zip.group(1))
+                info["Zip Code"] = state_zip.group(2)
+            else:
+                info["State"] = None
+                info["Zip Code"] = None
+    else:
+        # Handle the case where address_components is None
+        info["Street Name and Number"] = "Unknown"
+        info["City"] = "Unknown"
+        info["State"] = "Unknown"
+        info["Zip Code"] = "Unknown"
+
+waiver_parser = WaiverParser(waiver_sections, waiver_captures)
+
+# Extract needed information
+def extract_final_info(blocks, key):
+    return waiver_parser.parse(blocks, key)
+
+# Fields of the Excel rows, all expected on page 1 of a waiver
+required_fields = ("Issued To", "Responsible Person", "Street Name and Number", "City", "State", "Zip Code",
+                   "Waiver Number", "Operations Authorized", "List of Waived Regulations", "Effective Date",
+                   "Expire Date")
+
+# Fields filled by parse_address
+address_fields = ("Street Name and Number", "City", "State", "Zip Code")
+
+# Check what page 1 of a waiver is missing for the Excel rows: required fields left empty, and open-ended
+# sections whose end marker is not on page 1 (they may go on on the next page). Returns the missing field names.
+# An address parse_address cannot split (no comma after the city, no state and zip code) counts as missing.
+def find_missing_fields(blocks, key):
+    try:
+        info = extract_final_info(blocks, key)
+    except (ValueError, AttributeError):
+        return list(address_fields)
+    missing = [field for field in required_fields if not info[field]]
+    texts = [block['Text'] for block in blocks if block['BlockType'] == 'LINE' and block.get('Page', 1) == 1]
+    for field, (line_count, end_marker) in waiver_captures.items():
+        if line_count is None and field not in missing and not any(end_marker in text for text in texts):
+            missing.append(field)
+    return missing
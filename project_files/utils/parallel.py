@@ -0,0 +1,67 @@
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from utils.metrics import metrics
+from utils.module import check_waiver_codes, extract_final_info
+from utils.textract_results import decode_lines
+
+# Parse one waiver; runs in a worker process, so the JSON decoding happens there too.
+# compact tells if body is a compact LINE object or the raw Textract JSON.
+# Returns the info, the waived regulations and the seconds spent in each step, as metrics do not cross processes.
+def parse_waiver(body, compact, key):
+    start = time.perf_counter()
+    blocks = decode_lines(body) if compact else json.loads(body)['Blocks']
+    parsed = time.perf_counter()
+    info = extract_final_info(blocks, key)
+    extracted = time.perf_counter()
+    waived_regulations = check_waiver_codes(info["List of Waived Regulations"])
+    timings = {'json_parse': parsed - start, 'extract_final_info': extracted - parsed,
+               'check_waiver_codes': time.perf_counter() - extracted}
+    return info, waived_regulations, timings
+
+# Fetch and parse waivers in parallel and yield (obj, info, waived_regulations) in input order.
+# - fetch(key, etag) returns (body, compact) and runs on fetch_workers threads, etag is the one of obj if it has one
+# - parsing runs on parse_workers processes, or in the fetching threads when parse_workers is 0
+# - at most max_pending waivers are fetched or parsed ahead of the consumer
+# - mp_context: multiprocessing context of the parse processes, e.g. spawn when other threads are running
+# - fetch_parsed(obj), if given, runs on the fetch threads first and returns (info, waived_regulations) of a waiver
+#   parsed before, e.g. by the per-document handler, or None to fetch and parse it here
+def iter_parsed_waivers(objects, fetch, fetch_workers=8, parse_workers=None, max_pending=32, mp_context=None,
+                        fetch_parsed=None):
+    parse_pool = ProcessPoolExecutor(max_workers=parse_workers, mp_context=mp_context) if parse_workers != 0 else None
+
+    def fetch_and_parse(obj):
+        parsed = fetch_parsed(obj) if fetch_parsed else None
+        if parsed:
+            return parsed
+        body, compact = fetch(obj['Key'], obj.get('ETag'))
+        if parse_pool is None:
+            info, waived_regulations, timings = parse_waiver(body, compact, obj['Key'])
+        else:
+            info, waived_regulations, timings = parse_pool.submit(parse_waiver, body, compact, obj['Key']).result()
+        for operation, seconds in timings.items():
+            metrics.observe('excel', operation, seconds, obj['Key'])
+        return info, waived_regulations
+
+    pending = deque()
+    objects = iter(objects)
+    try:
+        with ThreadPoolExecutor(max_workers=fetch_workers) as fetch_pool:
+            for obj in objects:
+                # Hand over finished waivers first, objects may arrive slowly from an upstream stage
+                while pending and pending[0][1].done():
+                    done_obj, future = pending.popleft()
+                    yield (done_obj, *future.result())
+                pending.append((obj, fetch_pool.submit(fetch_and_parse, obj)))
+                if len(pending) >= max_pending:
+                    obj, future = pending.popleft()
+                    yield (obj, *future.result())
+            while pending:
+                obj, future = pending.popleft()
+                yield (obj, *future.result())
+    finally:
+        for obj, future in pending:
+            future.cancel()
+        if parse_pool is not None:
+            parse_pool.shutdown(cancel_futures=True)
@@ -0,0 +1,132 @@
+import io
+import json
+import re
+
+# Bytes read from each end of a PDF by a ranged validation. The header must be in the first 1024 bytes,
+# and the tail usually holds the trailer, the last xref section and often the catalog and page tree root.
+HEAD_SIZE = 1024
+TAIL_SIZE = 64 * 1024
+
+LINEARIZED_PATTERN = re.compile(rb'/Linearized\b(.{0,256}?)>>', re.DOTALL)
+ROOT_PATTERN = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+STARTXREF_PATTERN = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+
+# Find the dictionary of the last (most recently updated) definition of an indirect object,
+# looking in the tail first. Head and tail are searched separately, as the bytes between them are missing.
+def find_object(parts, number, generation):
+    pattern = re.compile(rb'(?<!\d)%d\s+%d\s+obj\b(.*?)endobj' % (number, generation), re.DOTALL)
+    for data in parts:
+        matches = list(pattern.finditer(data))
+        if matches:
+            return matches[-1].group(1)
+    return None
+
+def find_reference(dictionary, name):
+    match = re.search(rb'/' + name + rb'\s+(\d+)\s+(\d+)\s+R', dictionary)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+# Check the structure of a PDF from the bytes at its two ends and return its page count.
+# Returns None when the ends are inconclusive, e.g. when the page tree lives in a compressed object stream
+# or in the middle of the file, and the whole file has to be read instead.
+def count_pages_from_ends(head, tail, size):
+    if not head.startswith(b'%PDF-') or b'%%EOF' not in tail[-1024:]:
+        return None
+    startxref = STARTXREF_PATTERN.findall(tail)
+    if not startxref or int(startxref[-1]) >= size:
+        return None
+    # Linearized files carry the page count in their first object, valid if the file was not updated since
+    linearized = LINEARIZED_PATTERN.search(head)
+    if linearized:
+        length = re.search(rb'/L\s+(\d+)', linearized.group(1))
+        pages = re.search(rb'/N\s+(\d+)', linearized.group(1))
+        if length and pages and int(length.group(1)) == size:
+            return int(pages.group(1))
+    # Otherwise follow trailer /Root -> catalog /Pages -> page tree root /Count
+    parts = (tail,) if size <= len(tail) else (tail, head)
+    roots = ROOT_PATTERN.findall(tail)
+    if not roots:
+        return None
+    catalog = find_object(parts, int(roots[-1][0]), int(roots[-1][1]))
+    pages_reference = find_reference(catalog, b'Pages') if catalog else None
+    page_tree = find_object(parts, *pages_reference) if pages_reference else None
+    count = re.search(rb'/Count\s+(\d+)', page_tree) if page_tree else None
+    return int(count.group(1)) if count else None
+
+# Read the whole PDF and return its page count, raising if PyPDF2 cannot read it
+def count_pages(data):
+    # Imported here: most PDFs are validated from their ends alone, and PyPDF2 is slow to import
+    from PyPDF2 import PdfReader
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+# Copy the first page of a PDF into a PDF of its own, e.g. for a synchronous Textract call
+def extract_first_page(data):
+    from PyPDF2 import PdfReader, PdfWriter
+    writer = PdfWriter()
+    writer.add_page(PdfReader(io.BytesIO(data)).pages[0])
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+# Read the first and last bytes of an S3 object with two ranged GETs, or one when the object is small.
+# Returns (head, tail, size, etag); for objects up to tail_size bytes head and tail are the whole object.
+def read_object_ends(s3_client, bucket, key, head_size=HEAD_SIZE, tail_size=TAIL_SIZE):
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=-{tail_size}")
+    tail = response['Body'].read()
+    size = int(response['ContentRange'].rsplit('/', 1)[1]) if 'ContentRange' in response else len(tail)
+    if size <= len(tail):
+        return tail, tail, size, response['ETag']
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{head_size - 1}", IfMatch=response['ETag'])
+    return response['Body'].read(), tail, size, response['ETag']
+
+# Validation results of PDFs by S3 ETag, kept as a JSON object in S3 so a file is validated only once across runs.
+# Maps ETag -> page count, or None for an invalid PDF. Call save() at the end of a run.
+# With an object_cache (utils.s3_cache.S3ObjectCache) the JSON object is read through it.
+class ValidationCache:
+    def __init__(self, s3_client, bucket, key, object_cache=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.object_cache = object_cache
+        self.results = None
+        self.changed = False
+
+    def load(self):
+        try:
+            if self.object_cache:
+                self.results = json.loads(self.object_cache.read(self.bucket, self.key))
+            else:
+                cache_file = self.s3_client.get_object(Bucket=self.bucket, Key=self.key)
+                self.results = json.loads(cache_file['Body'].read())
+        except self.s3_client.exceptions.NoSuchKey:
+            self.results = {}
+
+    def __contains__(self, etag):
+        if self.results is None:
+            self.load()
+        return etag in self.results
+
+    def get(self, etag):
+        if self.results is None:
+            self.load()
+        return self.results.get(etag)
+
+    # Forget the loaded results, so the next use reads them from S3 again
+    def reset(self):
+        self.results = None
+        self.changed = False
+
+    def set(self, etag, pages):
+        if self.results is None:
+            self.load()
+        self.results[etag] = pages
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        body = json.dumps(self.results).encode('utf-8')
+        response = self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=body,
+                                             ContentType='application/json')
+        if self.object_cache:
+            self.object_cache.put(self.bucket, self.key, response['ETag'], io.BytesIO(body))
+        self.changed = False
@@ -0,0 +1,173 @@
+import datetime
+import json
+import sqlite3
+import time
+from utils.workbook import CellValue, is_external_link
+
+# Columns of the Waiver Data and Locations sheets, in sheet order. Cells right of them are kept in 'extra'.
+WAIVER_DATA_COLUMNS = (
+    'operator_id', 'company_id', 'full_operator_id', 'effective_date', 'expire_date', 'waiver_number',
+    'waiver_url', 'daylight_operations', 'vlos_operations', 'visual_observer', 'multiple_uas', 'over_people',
+    'certain_airspace', 'operating_limitations_a', 'operating_limitations_bcd', 'moving_vehicle',
+    'over_moving_vehicles', 'operations_authorized'
+)
+LOCATIONS_COLUMNS = (
+    'operator_id', 'company_id', 'full_operator_id', 'responsible_person', 'street', 'city', 'state', 'zip_code',
+    'column_9', 'column_10', 'column_11', 'company'
+)
+# Sheet title -> (table, columns)
+SHEETS = {
+    'Waiver Data': ('waiver_data', WAIVER_DATA_COLUMNS),
+    'Locations': ('locations', LOCATIONS_COLUMNS),
+}
+
+# Date and time cells are stored as ISO text after a type tag, and turned back into their type when read.
+# Text cells never start with the tag: openpyxl does not accept control characters in cell values.
+TYPE_TAG = '\x00'
+DATE_TYPES = {'datetime': datetime.datetime, 'date': datetime.date, 'time': datetime.time}
+
+# Cell value as stored in SQLite
+def to_sql(value):
+    # datetime first, it is also a date
+    for name in ('datetime', 'date', 'time'):
+        if isinstance(value, DATE_TYPES[name]):
+            return f"{TYPE_TAG}{name}:{value.isoformat()}"
+    return value
+
+# Cell value read back from SQLite, see to_sql
+def from_sql(value):
+    if isinstance(value, str) and value.startswith(TYPE_TAG):
+        name, text = value[len(TYPE_TAG):].split(':', 1)
+        return DATE_TYPES[name].fromisoformat(text)
+    return value
+
+# Extracted waivers and the rows of the Waiver Data and Locations sheets, kept in a local SQLite file.
+# - records: extract_final_info and check_waiver_codes results per JSON key, indexed on Waiver Number and
+#   Responsible Person
+# - waiver_data, locations: one row per sheet row below the header, with the sheet row number as key
+# Changes are committed by commit(), once per run, and the sheets are rendered from the tables in one pass.
+class RecordStore:
+    def __init__(self, path):
+        self.path = path
+        # Used by one thread at a time, but not necessarily the one that opened it (e.g. in pipeline)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            "json_key TEXT PRIMARY KEY, etag TEXT NOT NULL, waiver_number TEXT, responsible_person TEXT, "
+            "info TEXT, waived TEXT, updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS records_waiver_number ON records (waiver_number)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS records_responsible_person ON records (responsible_person)")
+        for table, columns in SHEETS.values():
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (row INTEGER PRIMARY KEY, "
+                                    f"{', '.join(columns)}, extra TEXT)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS waiver_data_waiver_number ON waiver_data (waiver_number)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS locations_responsible_person ON locations (responsible_person)")
+        self.connection.commit()
+
+    # Check if the store has no sheet rows yet, e.g. before the first import
+    def is_empty(self):
+        return all(self.connection.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone() is None
+                   for table, columns in SHEETS.values())
+
+    # Copy the rows below the header of the Waiver Data and Locations sheets of a workbook into the store,
+    # without their external links
+    def import_workbook(self, workbook):
+        for title in SHEETS:
+            sheet = self.sheet(title)
+            rows = ((row_number, values) for row_number, values in
+                    enumerate(([None if is_external_link(cell) else cell.value for cell in row]
+                               for row in workbook[title].iter_rows(min_row=2)), start=2)
+                    if any(value is not None for value in values))
+            sheet.insert_rows(rows)
+
+    # Record the parsed waiver of a JSON object
+    def put_record(self, obj, final_extracted_info, waived_regulations):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO records (json_key, etag, waiver_number, responsible_person, info, waived, "
+            "updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (obj['Key'], obj['ETag'], final_extracted_info.get("Waiver Number"),
+             (final_extracted_info.get("Responsible Person") or '').strip() or None,
+             json.dumps(final_extracted_info), json.dumps(waived_regulations), time.time()))
+
+    # Waiver Number -> row in the Waiver Data sheet, the last row for a number listed twice like get_waiver_rows
+    def waiver_rows(self):
+        return dict(self.connection.execute("SELECT waiver_number, row FROM waiver_data "
+                                            "WHERE waiver_number IS NOT NULL AND waiver_number != '' ORDER BY row"))
+
+    def sheet(self, title):
+        return StoreSheet(self, title)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+# A sheet of the workbook backed by a table of a RecordStore.
+# Supports the parts of the openpyxl worksheet API used by jsontoexcelcloud and LocationsIndex:
+# cell(), iter_rows(values_only=True) and max_row. Row 1, the header, stays in the workbook.
+class StoreSheet:
+    def __init__(self, store, title):
+        self.store = store
+        self.title = title
+        self.table, self.columns = SHEETS[title]
+        self.connection = store.connection
+        self.max_row = self.connection.execute(f"SELECT MAX(row) FROM {self.table}").fetchone()[0] or 1
+
+    def insert_rows(self, rows):
+        width = len(self.columns)
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {self.table} (row, {', '.join(self.columns)}, extra) "
+            f"VALUES ({', '.join('?' * (width + 2))})",
+            ((row_number,) + tuple(to_sql(value) for value in (tuple(row[:width]) + (None,) * (width - len(row))))
+             + (json.dumps([to_sql(value) for value in row[width:]]) if len(row) > width else None,)
+             for row_number, row in rows))
+        self.max_row = self.connection.execute(f"SELECT MAX(row) FROM {self.table}").fetchone()[0] or 1
+
+    def read_row(self, row):
+        result = self.connection.execute(f"SELECT {', '.join(self.columns)}, extra FROM {self.table} WHERE row = ?",
+                                         (row,)).fetchone()
+        return self.values(result) if result else None
+
+    # Row values of a table row: the columns, then the extra cells
+    @staticmethod
+    def values(result):
+        return tuple(from_sql(value) for value in result[:-1]) + \
+            (tuple(from_sql(value) for value in json.loads(result[-1])) if result[-1] else ())
+
+    def cell(self, row, column, value=None):
+        # Like openpyxl, writing None leaves the cell unchanged
+        if value is not None:
+            if column <= len(self.columns):
+                name = self.columns[column - 1]
+                self.connection.execute(f"INSERT INTO {self.table} (row, {name}) VALUES (?, ?) "
+                                        f"ON CONFLICT (row) DO UPDATE SET {name} = excluded.{name}",
+                                        (row, to_sql(value)))
+            else:
+                values = list(self.read_row(row) or (None,) * len(self.columns))
+                values.extend([None] * (column - len(values)))
+                values[column - 1] = value
+                self.insert_rows([(row, values)])
+            self.max_row = max(self.max_row, row)
+            return CellValue(value)
+        values = self.read_row(row)
+        return CellValue(values[column - 1] if values and column <= len(values) else None)
+
+    def iter_rows(self, min_row=1, max_row=None, min_col=1, max_col=None, values_only=True):
+        if not values_only:
+            raise ValueError("StoreSheet only supports values_only=True")
+        max_row = self.max_row if max_row is None else max_row
+        rows = self.connection.execute(f"SELECT row, {', '.join(self.columns)}, extra FROM {self.table} "
+                                       f"WHERE row BETWEEN ? AND ? ORDER BY row", (min_row, max_row))
+        start = min_col - 1
+        end = None if max_col is None else max_col
+        next_row = min_row
+        for result in rows:
+            # Rows missing from the table are empty in the sheet
+            for _ in range(next_row, result[0]):
+                yield (None,) * ((end or len(self.columns)) - start)
+            yield self.values(result[1:])[start:end]
+            next_row = result[0] + 1
+        for _ in range(next_row, max_row + 1):
+            yield (None,) * ((end or len(self.columns)) - start)
@@ -0,0 +1,247 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from botocore.exceptions import ClientError
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Local directory of the cache, shared by all scripts of the pipeline
+cache_dir = os.path.join(tempfile.gettempdir(), 'waivers-s3-cache')
+
+# Check if a get_object error is S3's answer to IfNoneMatch for an unchanged object
+def is_not_modified(error):
+    return error.response.get('Error', {}).get('Code') in ('304', 'NotModified')
+
+# Local disk cache of S3 objects, keyed by bucket, key and ETag, shared by the scripts and across runs.
+# - Every object is stored in a file named after the hash of its bucket/key/ETag, written to a temporary
+#   file first and renamed, so readers never see a partial object.
+# - A SQLite index maps bucket/key to the cached ETag, size and last use. It keeps one version per key and
+#   evicts the least recently used objects while the cache is larger than max_bytes.
+# - Reads with a known ETag (e.g. from a listing) are served without a request. Otherwise a cached object is
+#   revalidated with a conditional GET (IfNoneMatch), which transfers nothing if it has not changed.
+# With max_bytes <= 0 the cache is disabled and every read goes to S3.
+# Hits, revalidations and misses are counted in metrics under the given stage.
+class S3ObjectCache:
+    def __init__(self, s3_client, stage, max_bytes, directory=None):
+        self.s3_client = s3_client
+        self.stage = stage
+        self.max_bytes = max_bytes
+        self.directory = directory or cache_dir
+        self.lock = threading.RLock()
+        self.connection = None
+        self.counts = {'hit': 0, 'revalidated': 0, 'miss': 0}
+
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def record(self, name):
+        with self.lock:
+            self.counts[name] += 1
+        metrics.count(self.stage, f"s3_cache_{name}")
+
+    # Open the index on first use, so a disabled cache never touches the disk
+    def open_index(self):
+        with self.lock:
+            if self.connection is None:
+                self.connect()
+        return self.connection
+
+    def connect(self):
+        os.makedirs(self.directory, exist_ok=True)
+        # Shared by the fetch threads, and with other processes through SQLite's own locking
+        self.connection = sqlite3.connect(os.path.join(self.directory, 'index.db'), timeout=30,
+                                          check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            "bucket TEXT NOT NULL, key TEXT NOT NULL, etag TEXT NOT NULL, size INTEGER NOT NULL, "
+            "last_used REAL NOT NULL, PRIMARY KEY (bucket, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used)")
+        self.connection.commit()
+
+    def path(self, bucket, key, etag):
+        return os.path.join(self.directory, hashlib.sha256(f"{bucket}/{key}/{etag}".encode('utf-8')).hexdigest())
+
+    # Path of the cached object if it is there with the given ETag, or any ETag if etag is None.
+    # Returns (path, etag), or (None, None) on a miss.
+    def lookup(self, bucket, key, etag=None):
+        with self.lock:
+            row = self.open_index().execute("SELECT etag FROM objects WHERE bucket = ? AND key = ?",
+                                            (bucket, key)).fetchone()
+        if not row or (etag is not None and row[0] != etag):
+            return None, None
+        path = self.path(bucket, key, row[0])
+        if not os.path.exists(path):
+            # Removed from disk behind the index
+            self.remove(bucket, key)
+            return None, None
+        return path, row[0]
+
+    def touch(self, bucket, key):
+        with self.lock, self.open_index() as connection:
+            connection.execute("UPDATE objects SET last_used = ? WHERE bucket = ? AND key = ?",
+                               (time.time(), bucket, key))
+
+    def remove(self, bucket, key):
+        with self.lock, self.open_index() as connection:
+            row = connection.execute("SELECT etag FROM objects WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+            connection.execute("DELETE FROM objects WHERE bucket = ? AND key = ?", (bucket, key))
+        if row:
+            self.unlink(self.path(bucket, key, row[0]))
+
+    def unlink(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # Store the rest of a file object as the given version of an object, replacing older ones, and return its path.
+    # Local disk errors are logged and return None: the cache is only an optimization.
+    def put(self, bucket, key, etag, fileobj):
+        if not self.enabled():
+            return None
+        try:
+            self.open_index()
+            with tempfile.NamedTemporaryFile(dir=self.directory, delete=False, suffix='.tmp') as f:
+                try:
+                    shutil.copyfileobj(fileobj, f, 1024 * 1024)
+                except BaseException:
+                    f.close()
+                    self.unlink(f.name)
+                    raise
+                size = f.tell()
+            path = self.path(bucket, key, etag)
+            os.replace(f.name, path)
+            with self.lock, self.connection as connection:
+                row = connection.execute("SELECT etag FROM objects WHERE bucket = ? AND key = ?",
+                                         (bucket, key)).fetchone()
+                connection.execute("INSERT OR REPLACE INTO objects (bucket, key, etag, size, last_used) "
+                                   "VALUES (?, ?, ?, ?, ?)", (bucket, key, etag, size, time.time()))
+            if row and row[0] != etag:
+                self.unlink(self.path(bucket, key, row[0]))
+            self.evict(keep=(bucket, key))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning("Failed to cache %s. Error: %s", key, str(e))
+            return None
+        return path
+
+    # Upload the rest of a file object to S3 and keep the uploaded version in the cache, so the next run only
+    # checks its ETag. upload_fileobj closes the file object, so it is uploaded from a local copy.
+    def upload(self, fileobj, bucket, key):
+        if not self.enabled():
+            self.s3_client.upload_fileobj(fileobj, bucket, key)
+            return
+        self.open_index()
+        with tempfile.NamedTemporaryFile(dir=self.directory, delete=False, suffix='.tmp') as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        try:
+            self.s3_client.upload_file(f.name, bucket, key)
+            etag = self.s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+            with open(f.name, 'rb') as uploaded:
+                self.put(bucket, key, etag, uploaded)
+        finally:
+            self.unlink(f.name)
+
+    # Drop the least recently used objects until the cache fits in max_bytes. The object in keep, the one
+    # just stored, stays even if it is larger than the cache on its own.
+    def evict(self, keep=None):
+        with self.lock, self.connection as connection:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            evicted = []
+            for bucket, key, etag, size in connection.execute(
+                    "SELECT bucket, key, etag, size FROM objects ORDER BY last_used").fetchall():
+                if total <= self.max_bytes:
+                    break
+                if (bucket, key) == keep:
+                    continue
+                evicted.append((bucket, key, etag))
+                total -= size
+            connection.executemany("DELETE FROM objects WHERE bucket = ? AND key = ?",
+                                   [(bucket, key) for bucket, key, etag in evicted])
+        for bucket, key, etag in evicted:
+            self.unlink(self.path(bucket, key, etag))
+        metrics.count(self.stage, 's3_cache_evicted', len(evicted))
+        logger.info("Evicted %d objects from the S3 cache at %s.", len(evicted), self.directory)
+
+    # Check if an object is cached with the given ETag, without any request
+    def cached(self, bucket, key, etag):
+        return self.enabled() and self.lookup(bucket, key, etag)[0] is not None
+
+    # Local path and ETag of an object, downloading it unless the cached version is current.
+    # Pass the ETag when it is known, e.g. from a listing, to skip the request on a hit.
+    # S3 errors, such as NoSuchKey, are raised as by get_object.
+    def fetch(self, bucket, key, etag=None):
+        if etag is not None:
+            path, cached_etag = self.lookup(bucket, key, etag)
+            if path:
+                self.touch(bucket, key)
+                self.record('hit')
+                return path, cached_etag
+            # Changed since it was cached, or not cached at all
+        else:
+            path, cached_etag = self.lookup(bucket, key)
+        kwargs = {'IfNoneMatch': cached_etag} if path else {}
+        try:
+            response = self.s3_client.get_object(Bucket=bucket, Key=key, **kwargs)
+        except ClientError as e:
+            if not path or not is_not_modified(e):
+                raise
+            self.touch(bucket, key)
+            self.record('revalidated')
+            return path, cached_etag
+        self.record('miss')
+        with response['Body'] as body:
+            path = self.put(bucket, key, response['ETag'], body)
+        if path is None:
+            raise OSError(f"{key} could not be cached")
+        return path, response['ETag']
+
+    # Body and ETag of an object, see fetch. Falls back to S3 when the local disk fails.
+    def get(self, bucket, key, etag=None):
+        if self.enabled():
+            try:
+                f, etag = self.open_cached(bucket, key, etag)
+                with f:
+                    return f.read(), etag
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Failed to read %s through the S3 cache. Error: %s", key, str(e))
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read(), response['ETag']
+
+    # Body of an object as bytes, see fetch
+    def read(self, bucket, key, etag=None):
+        return self.get(bucket, key, etag)[0]
+
+    # Binary file object of an object, see fetch. A disabled cache, or a failing local disk, spools the
+    # object to a temporary file instead.
+    def open(self, bucket, key, etag=None, spool_size=64 * 1024 * 1024):
+        if self.enabled():
+            try:
+                return self.open_cached(bucket, key, etag)[0]
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Failed to read %s through the S3 cache. Error: %s", key, str(e))
+        fileobj = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        # get_object rather than download_fileobj, whose HeadObject answers a missing key with a 404 ClientError
+        with self.s3_client.get_object(Bucket=bucket, Key=key)['Body'] as body:
+            shutil.copyfileobj(body, fileobj, 1024 * 1024)
+        fileobj.seek(0)
+        return fileobj
+
+    # Open the cached file of an object and return it with its ETag, fetching the object again if it was
+    # evicted by another thread or process between the fetch and the open
+    def open_cached(self, bucket, key, etag=None):
+        try:
+            path, etag = self.fetch(bucket, key, etag)
+            return open(path, 'rb'), etag
+        except FileNotFoundError:
+            self.remove(bucket, key)
+            path, etag = self.fetch(bucket, key, etag)
+            return open(path, 'rb'), etag
@@ -0,0 +1,90 @@
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Local directory for cached key listings
+cache_dir = os.path.join(tempfile.gettempdir(), 'waivers-s3-index')
+
+# Lazily yield the objects under an S3 prefix as {'Key', 'Size', 'ETag', ...} dicts, one listing page at a time.
+# - suffixes: only keys ending with one of these (case-insensitive) are yielded
+# - start_after: only keys after this one are listed
+def iter_s3_objects(s3_client, bucket, prefix, suffixes=None, start_after=None):
+    paginator = s3_client.get_paginator('list_objects_v2')
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start_after:
+        kwargs['StartAfter'] = start_after
+    if suffixes:
+        suffixes = tuple(suffix.lower() for suffix in suffixes)
+    for page in paginator.paginate(**kwargs):
+        for item in page.get('Contents', []):
+            if not suffixes or item['Key'].lower().endswith(suffixes):
+                yield item
+
+# Set of the keys under an S3 prefix, built from one paginated list_objects_v2 sweep on first use.
+# Replaces a head_object round trip per document with one LIST call per 1000 keys.
+# With ttl > 0 the listing is also cached on local disk and reused while it is younger than ttl seconds;
+# call save() at the end of a run to add the keys written during it to the cache.
+class S3KeyIndex:
+    def __init__(self, s3_client, bucket, prefix, ttl=0):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl = ttl
+        self.keys = None
+        self.listed_at = None
+        self.cache_path = os.path.join(cache_dir, f"{bucket}-{prefix.strip('/').replace('/', '_')}.json")
+
+    def __contains__(self, key):
+        if self.keys is None:
+            self.load()
+        return key in self.keys
+
+    # Record a key written during this run. Before the first use there is nothing to do: the listing will include it.
+    def add(self, key):
+        if self.keys is not None:
+            self.keys.add(key)
+
+    # Forget the listing, so the next use lists the prefix again, e.g. in the next invocation of a warm handler
+    def reset(self):
+        self.keys = None
+        self.listed_at = None
+
+    def load(self):
+        if self.ttl > 0 and self.load_cache():
+            return
+        start = time.perf_counter()
+        self.keys = {item['Key'] for item in iter_s3_objects(self.s3_client, self.bucket, self.prefix)}
+        self.listed_at = time.time()
+        logger.info("Listed %d keys under s3://%s/%s in %.1f seconds.", len(self.keys), self.bucket, self.prefix,
+                    time.perf_counter() - start)
+        self.save()
+
+    def load_cache(self):
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+            if time.time() - cache['listed_at'] > self.ttl:
+                return False
+            self.keys = set(cache['keys'])
+            self.listed_at = cache['listed_at']
+            return True
+        except (OSError, ValueError, KeyError):
+            return False
+
+    # Write the listing, including keys added since, to the local cache. The cache keeps the time of the
+    # S3 listing, so adding keys does not extend its lifetime.
+    def save(self):
+        if self.ttl <= 0 or self.keys is None:
+            return
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file first so readers never see a partial listing
+            with tempfile.NamedTemporaryFile('w', dir=cache_dir, delete=False, suffix='.tmp') as f:
+                json.dump({'listed_at': self.listed_at, 'keys': sorted(self.keys)}, f)
+            os.replace(f.name, self.cache_path)
+        except OSError as e:
+            logger.warning("Failed to cache the key listing at %s. Error: %s", self.cache_path, str(e))
@@ -0,0 +1,193 @@
+import json
+import logging
+import random
+import time
+from botocore.exceptions import ClientError
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Textract error codes which mean "slow down and try again"
+THROTTLING_ERRORS = (
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'LimitExceededException'
+)
+
+# Textract job statuses which mean the job will not change anymore
+FINISHED_STATUSES = ('SUCCEEDED', 'FAILED', 'PARTIAL_SUCCESS')
+
+# Check if an exception raised by boto3 is a throttling error
+def is_throttling_error(error):
+    if not isinstance(error, ClientError):
+        return False
+    return error.response.get('Error', {}).get('Code') in THROTTLING_ERRORS
+
+# Call a Textract API function, retrying with jittered exponential backoff while it is throttled
+def call_with_retry(func, *args, max_retries=8, base_delay=1, max_delay=30, sleep=time.sleep, **kwargs):
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if not is_throttling_error(e) or attempt >= max_retries:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt) * random.uniform(0.5, 1)
+            logger.warning("Throttled by Textract, retrying in %.1f seconds. Error: %s", delay, str(e))
+            sleep(delay)
+            attempt += 1
+
+# The running Textract jobs of a run, at most max_in_flight at a time, refilled from documents as they finish.
+# Shared by the polling and the notification driven schedulers.
+# - documents: iterable of documents, consumed lazily as slots free up. It may yield None when no document is
+#   ready yet (e.g. while an upstream stage is still downloading), the schedulers then check back later.
+# - start_job(document): starts a job and returns its JobId
+# - on_result(document, job_id, response): called with the first get_document_text_detection page
+# - resume: {document: JobId} of jobs started by an earlier run, awaited along with the new ones
+class JobSlots:
+    def __init__(self, documents, start_job, on_result, max_in_flight=10, sleep=time.sleep, resume=None):
+        self.pending = iter(documents)
+        self.start_job = start_job
+        self.on_result = on_result
+        self.max_in_flight = max_in_flight
+        self.sleep = sleep
+        self.in_flight = {job_id: document for document, job_id in (resume or {}).items()}  # JobId -> document
+        self.completed = 0
+        self.exhausted = False
+        self.started_at = {}    # JobId -> time.monotonic() of its start, for jobs started by this run
+
+    # Start new jobs until every slot is taken or there are no documents left
+    def fill(self):
+        if len(self.in_flight) >= self.max_in_flight:
+            return
+        for document in self.pending:
+            if document is None:
+                return
+            try:
+                job_id = call_with_retry(self.start_job, document, sleep=self.sleep)
+            except Exception as e:
+                logger.error("Failed to process %s. Error: %s", document, str(e))
+                continue
+            self.in_flight[job_id] = document
+            self.started_at[job_id] = time.monotonic()
+            if len(self.in_flight) >= self.max_in_flight:
+                return
+        self.exhausted = True
+
+    # Check if there are jobs running or documents left to start
+    def active(self):
+        return bool(self.in_flight) or not self.exhausted
+
+    # Fetch the first result page of a job and hand it to on_result if the job has finished.
+    # Returns True when the job left its slot, finished or failed to be read.
+    def check(self, textract_client, job_id):
+        document = self.in_flight[job_id]
+        try:
+            response = call_with_retry(textract_client.get_document_text_detection, JobId=job_id, sleep=self.sleep)
+        except Exception as e:
+            logger.error("Failed to get Textract result for %s. Error: %s", document, str(e))
+            del self.in_flight[job_id]
+            self.started_at.pop(job_id, None)
+            return True
+        if response['JobStatus'] not in FINISHED_STATUSES:
+            return False
+        del self.in_flight[job_id]
+        self.completed += 1
+        if job_id in self.started_at:
+            # From the start of the job until it was seen finished: Textract queueing and processing
+            metrics.observe('textract', 'job', time.monotonic() - self.started_at.pop(job_id), document)
+        try:
+            self.on_result(document, job_id, response)
+        except Exception as e:
+            logger.error("An unexpected error occurred while processing %s. Error: %s", document, str(e))
+        return True
+
+# Keep up to max_in_flight Textract jobs running, poll them all together and hand every
+# finished job to on_result as soon as it completes. See JobSlots for the arguments.
+def run_textract_jobs(textract_client, documents, start_job, on_result, max_in_flight=10,
+                      min_poll_delay=1, max_poll_delay=20, sleep=time.sleep, resume=None):
+    slots = JobSlots(documents, start_job, on_result, max_in_flight=max_in_flight, sleep=sleep, resume=resume)
+    poll_delay = min_poll_delay
+
+    slots.fill()
+    while slots.active():
+        # Poll every running job once
+        finished_any = False
+        for job_id in list(slots.in_flight):
+            finished_any = slots.check(textract_client, job_id) or finished_any
+
+        slots.fill()
+        if not slots.active():
+            break
+        # Back off while nothing finishes, go back to the fast interval as soon as something does
+        # or while waiting for documents
+        if finished_any or not slots.in_flight:
+            poll_delay = min_poll_delay
+        else:
+            poll_delay = min(max_poll_delay, poll_delay * 2)
+        logger.info("Waiting for %d Textract jobs to complete.", len(slots.in_flight))
+        sleep(poll_delay)
+
+    return slots.completed
+
+# Read a Textract completion message received from SQS: JobId, Status, DocumentLocation, ...
+# Handles messages delivered through an SNS subscription (JSON envelope) and raw message delivery.
+def read_completion_message(body):
+    message = json.loads(body)
+    if 'Message' in message and 'JobId' not in message:
+        message = json.loads(message['Message'])
+    return message
+
+# Read the JobId and status from a Textract completion message received from SQS
+def parse_completion_message(body):
+    message = read_completion_message(body)
+    return message['JobId'], message['Status']
+
+# Like run_textract_jobs, but learns about finished jobs from the SQS queue subscribed to the SNS topic
+# passed as NotificationChannel to start_document_text_detection, instead of polling every job.
+# Results are only fetched for jobs reported finished. The queue is long-polled and read in batches of 10.
+# Every sweep_interval seconds, and once at the start for resumed jobs, all running jobs are polled directly,
+# so a lost notification delays a job instead of losing it. The queue must be dedicated to this stage:
+# notifications for unknown jobs are deleted.
+def run_textract_jobs_notified(textract_client, sqs_client, queue_url, documents, start_job, on_result,
+                               max_in_flight=10, wait_time=20, sweep_interval=300, sleep=time.sleep,
+                               clock=time.monotonic, resume=None):
+    slots = JobSlots(documents, start_job, on_result, max_in_flight=max_in_flight, sleep=sleep, resume=resume)
+    last_sweep = clock() if not resume else None
+
+    slots.fill()
+    while slots.active():
+        if not slots.in_flight:
+            # Nothing to wait for until the next document is ready
+            sleep(1)
+            slots.fill()
+            continue
+        if last_sweep is None or clock() - last_sweep >= sweep_interval:
+            for job_id in list(slots.in_flight):
+                slots.check(textract_client, job_id)
+            last_sweep = clock()
+            slots.fill()
+            continue
+
+        response = sqs_client.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=wait_time)
+        handled = []
+        for message in response.get('Messages', []):
+            try:
+                job_id, status = parse_completion_message(message['Body'])
+            except (ValueError, KeyError) as e:
+                logger.warning("Ignoring malformed Textract notification %s. Error: %s", message['MessageId'], str(e))
+            else:
+                if job_id in slots.in_flight:
+                    logger.info("Textract job %s for %s finished with status %s.", job_id, slots.in_flight[job_id], status)
+                    slots.check(textract_client, job_id)
+                else:
+                    logger.debug("Ignoring notification for unknown Textract job %s.", job_id)
+            handled.append({'Id': message['MessageId'], 'ReceiptHandle': message['ReceiptHandle']})
+        if handled:
+            sqs_client.delete_message_batch(QueueUrl=queue_url, Entries=handled)
+
+        slots.fill()
+        if slots.in_flight:
+            logger.info("Waiting for notifications of %d Textract jobs.", len(slots.in_flight))
+
+    return slots.completed
@@ -0,0 +1,85 @@
+import gzip
+import io
+import json
+import os
+from utils.scheduler import call_with_retry
+
+# S3 subfolder for the compact page-1 LINE objects derived from the raw Textract JSON
+lines_dir = 'waivers-lines'
+
+# Response keys which are not copied into the assembled result
+SKIPPED_KEYS = ('Blocks', 'NextToken', 'ResponseMetadata')
+
+# Yield every page of a finished Textract job, following NextToken
+def iter_result_pages(textract_client, job_id, first_page):
+    page = first_page
+    yield page
+    while page.get('NextToken'):
+        page = call_with_retry(textract_client.get_document_text_detection,
+                               JobId=job_id, NextToken=page['NextToken'])
+        yield page
+
+# Yield the assembled result JSON in chunks, one chunk per Textract page.
+# The output has the same shape as a single get_document_text_detection response
+# with the Blocks of all pages, without NextToken.
+def iter_result_json(pages):
+    separator = ''
+    started = False
+    for page in pages:
+        if not started:
+            header = {key: value for key, value in page.items() if key not in SKIPPED_KEYS}
+            yield (json.dumps(header)[:-1] + (', ' if header else '') + '"Blocks": [').encode('utf-8')
+            started = True
+        if page.get('Blocks'):
+            yield (separator + ', '.join(json.dumps(block) for block in page['Blocks'])).encode('utf-8')
+            separator = ', '
+    if not started:
+        yield b'{"Blocks": ['
+    yield b']}'
+
+# Get the key of the compact LINE object belonging to a raw Textract JSON key
+def get_lines_key(json_key):
+    return f"{lines_dir}/{os.path.basename(json_key)}.gz"
+
+# Pass pages through unchanged while copying their page-1 LINE blocks into lines.
+# Only the fields extract_final_info reads are kept, in page order.
+def collect_lines(pages, lines):
+    for page in pages:
+        lines.extend({'BlockType': 'LINE', 'Page': 1, 'Text': block['Text']}
+                     for block in page.get('Blocks', [])
+                     if block['BlockType'] == 'LINE' and block.get('Page', 1) == 1)
+        yield page
+
+# Encode LINE blocks as the gzipped JSON body of a compact LINE object, with the ETag of the raw JSON they come from
+def encode_lines(lines, source_etag):
+    return gzip.compress(json.dumps({'ETag': source_etag, 'Blocks': lines}).encode('utf-8'))
+
+# Decode the body of a compact LINE object back into LINE blocks
+def decode_lines(body):
+    return json.loads(gzip.decompress(body))['Blocks']
+
+# ETag of the raw JSON a compact LINE object was derived from, None for objects written without one
+def decode_source_etag(body):
+    return json.loads(gzip.decompress(body)).get('ETag')
+
+# Read-only file object over an iterator of bytes chunks, used to stream uploads to S3
+class IterStream(io.RawIOBase):
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = b''
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.offset >= len(self.chunk):
+            try:
+                self.chunk = next(self.chunks)
+            except StopIteration:
+                return 0
+            self.offset = 0
+        size = min(len(buffer), len(self.chunk) - self.offset)
+        buffer[:size] = self.chunk[self.offset:self.offset + size]
+        self.offset += size
+        return size
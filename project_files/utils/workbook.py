@@ -0,0 +1,96 @@
+import re
+
+# Reference into an external workbook within a formula, e.g. the [1] of =[1]Sheet1!A1 or =SUM([1]Sheet1!A1:A3)
+EXTERNAL_REFERENCE = re.compile(r'\[\d+\]')
+
+# Check if a cell holds a formula pointing into an external workbook.
+# openpyxl keeps formulas as strings starting with '=', array formulas are not strings.
+def is_external_link(cell):
+    return cell.data_type == 'f' and isinstance(cell.value, str) and EXTERNAL_REFERENCE.search(cell.value) is not None
+
+# Value holder returned by EditableSheet.cell, mirrors openpyxl's cell.value
+class CellValue:
+    def __init__(self, value):
+        self.value = value
+
+# A read-only worksheet plus the edits made to it during a run.
+# Supports the parts of the openpyxl worksheet API used by jsontoexcelcloud and LocationsIndex:
+# cell(), iter_rows(values_only=True) and max_row. The edits are applied by save_streaming.
+class EditableSheet:
+    def __init__(self, sheet):
+        self.sheet = sheet
+        self.title = sheet.title
+        if sheet.max_row is None:
+            sheet.calculate_dimension(force=True)
+        self.max_row = sheet.max_row or 1
+        self.edits = {}     # row number -> {column number: value}
+        self.columns = {}   # column number -> cached values of the unedited sheet, read on first use
+
+    def cell(self, row, column, value=None):
+        # Like openpyxl, writing None leaves the cell unchanged
+        if value is not None:
+            self.edits.setdefault(row, {})[column] = value
+            self.max_row = max(self.max_row, row)
+        if row in self.edits and column in self.edits[row]:
+            return CellValue(self.edits[row][column])
+        if column not in self.columns:
+            self.columns[column] = [values[0] for values in self.sheet.iter_rows(min_col=column, max_col=column, values_only=True)]
+        values = self.columns[column]
+        return CellValue(values[row - 1] if row <= len(values) else None)
+
+    def iter_rows(self, min_row=1, max_row=None, min_col=1, max_col=None, values_only=True):
+        if not values_only:
+            raise ValueError("EditableSheet only supports values_only=True")
+        max_row = self.max_row if max_row is None else max_row
+        source_rows = self.sheet.iter_rows(min_row=min_row, max_row=max_row, min_col=min_col, max_col=max_col,
+                                           values_only=True)
+        # The read-only reader stops at the last stored row, even when the dimension of the sheet goes further
+        empty_row = (None,) * max(0, (max_col or self.sheet.max_column or 0) - min_col + 1)
+        for row_number in range(min_row, max_row + 1):
+            row = list(next(source_rows, empty_row))
+            for column, value in self.edits.get(row_number, {}).items():
+                if column >= min_col and (max_col is None or column <= max_col):
+                    row.extend([None] * (column - min_col + 1 - len(row)))
+                    row[column - min_col] = value
+            yield tuple(row)
+
+# Copy a read-only workbook into a write-only workbook saved to fileobj, one row at a time.
+# Edits of the given EditableSheets are applied and external links are stripped during the copy.
+# Only values are copied: formatting and external link parts are not carried over.
+def save_streaming(workbook, edited_sheets, fileobj):
+    from openpyxl import Workbook
+    edited = {sheet.title: sheet for sheet in edited_sheets}
+    output = Workbook(write_only=True)
+    for source in workbook.worksheets:
+        target = output.create_sheet(source.title)
+        edits = edited[source.title].edits if source.title in edited else {}
+        row_number = 0
+        for row_number, row in enumerate(source.iter_rows(), start=1):
+            values = [None if is_external_link(cell) else cell.value for cell in row]
+            target.append(apply_row_edits(values, edits.get(row_number)))
+        for row_number in range(row_number + 1, max(edits, default=0) + 1):
+            target.append(apply_row_edits([], edits.get(row_number)))
+    output.save(fileobj)
+
+# Like save_streaming, but the rows below the header of the given sheets (e.g. StoreSheets of a RecordStore)
+# replace those of the workbook sheets with the same title, in one bulk write
+def save_rendered(workbook, rendered_sheets, fileobj):
+    from openpyxl import Workbook
+    rendered = {sheet.title: sheet for sheet in rendered_sheets}
+    output = Workbook(write_only=True)
+    for source in workbook.worksheets:
+        target = output.create_sheet(source.title)
+        for row in source.iter_rows(max_row=1 if source.title in rendered else None):
+            target.append([None if is_external_link(cell) else cell.value for cell in row])
+        if source.title in rendered:
+            for values in rendered[source.title].iter_rows(min_row=2, values_only=True):
+                target.append(values)
+    output.save(fileobj)
+
+# Apply the edits of one row to its values
+def apply_row_edits(values, row_edits):
+    if row_edits:
+        for column, value in row_edits.items():
+            values.extend([None] * (column - len(values)))
+            values[column - 1] = value
+    return values